@@ -0,0 +1,35 @@
+"""
+dispatch cost versus pattern count, Matcher against a chain of is_valid calls.
+
+    python benchmarks/bench_match.py
+"""
+import argparse
+import timeit
+import schema
+
+def patterns(n):
+    # message shapes like (':order', {...}), with the matching one last
+    return [((':msg-{}'.format(i), {'id': int, 'sender': str, 'items': [str]}), lambda msg: msg)
+            for i in range(n)]
+
+def linear(pats, value):
+    for sc, handler in pats:
+        if schema.is_valid(sc, value):
+            return handler(schema.validate(sc, value))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+    print('{:>8} {:>14} {:>14} {:>8}'.format('patterns', 'linear us/op', 'matcher us/op', 'speedup'))
+    for n in [1, 5, 10, 25, 50, 100, 200]:
+        pats = patterns(n)
+        matcher = schema.Matcher(pats)
+        value = [':msg-{}'.format(n - 1), {'id': 1, 'sender': 'jane', 'items': ['a', 'b']}]
+        assert matcher(value) == linear(pats, value)
+        a = min(timeit.repeat(lambda: linear(pats, value), number=args.number, repeat=3)) / args.number * 1e6
+        b = min(timeit.repeat(lambda: matcher(value), number=args.number, repeat=3)) / args.number * 1e6
+        print('{:>8} {:>14.2f} {:>14.2f} {:>7.1f}x'.format(n, a, b, a / b))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+throughput of validate_many versus worker count.
+
+    python benchmarks/bench_parallel.py --records 200000
+"""
+import argparse
+import os
+import time
+import schema
+
+record = {'id': int,
+          'name': str,
+          'score': lambda x: isinstance(x, float) and 0 <= x <= 1,
+          'tags': [str],
+          'address': {'street': str, 'zip': (':or', str, int)},
+          'active': (':optional', bool, True)}
+
+def records(n):
+    return [{'id': i,
+             'name': 'name-{}'.format(i),
+             'score': (i % 100) / 100,
+             'tags': ['a', 'b', 'c'],
+             'address': {'street': 'main', 'zip': i}}
+            for i in range(n)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--chunksize', type=int, default=1000)
+    args = parser.parse_args()
+    values = records(args.records)
+    print('{:>8} {:>14} {:>8}'.format('workers', 'records/sec', 'speedup'))
+    base = None
+    for workers in [None, 1, 2, 4, 8, 16, 32]:
+        if workers and workers > (os.cpu_count() or 1):
+            break
+        start = time.monotonic()
+        result = schema.validate_many(record, values, workers=workers, chunksize=args.chunksize)
+        elapsed = time.monotonic() - start
+        assert not result.errors
+        rate = args.records / elapsed
+        base = base or rate
+        print('{:>8} {:>14,.0f} {:>7.1f}x'.format(workers or '-', rate, rate / base))
+
+if __name__ == '__main__':
+    main()
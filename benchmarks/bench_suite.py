@@ -0,0 +1,217 @@
+"""
+ops/sec and peak bytes allocated per op for every schema construct and
+for check on functions, generators, async generators and coroutines.
+
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --compare --tolerance 0.1
+    python benchmarks/bench_suite.py --save
+    python benchmarks/bench_suite.py --only list
+
+with --compare, the exit code is 1 if any benchmark is slower than the
+baseline by more than the tolerance. without a path, --save and --compare
+use baseline.json beside this file, which is committed. ops/sec depend on
+the machine, so save a baseline on yours before comparing a change to it.
+"""
+import argparse
+import array
+import json
+import os
+import sys
+import time
+import tracemalloc
+import schema
+from schema import check
+
+def bench_wide_dict():
+    sc = {'key-{}'.format(i): int for i in range(100)}
+    value = {'key-{}'.format(i): i for i in range(100)}
+    return lambda: schema.validate(sc, value)
+
+def bench_deep_dict():
+    sc, value = int, 1
+    for i in range(20):
+        sc, value = {'child': sc, 'name': str}, {'child': value, 'name': 'node'}
+    return lambda: schema.validate(sc, value)
+
+def bench_list():
+    value = list(range(10000))
+    return lambda: schema.validate([int], value)
+
+def bench_list_str():
+    value = ['item-{}'.format(i) for i in range(10000)]
+    return lambda: schema.validate([str], value)
+
+def bench_list_union():
+    value = [i if i % 2 else float(i) for i in range(10000)]
+    return lambda: schema.validate([(':or', int, float)], value)
+
+def bench_list_enum():
+    value = ['red', 'green', 'blue'] * 3333
+    return lambda: schema.validate([(':or', 'red', 'green', 'blue')], value)
+
+def bench_list_of_dicts():
+    sc = [{'id': int, 'name': str, 'price': float}]
+    value = [{'id': i, 'name': 'item', 'price': 1.0} for i in range(1000)]
+    return lambda: schema.validate(sc, value)
+
+def bench_list_of_wide_dicts():
+    columns = [('id', int), ('name', str), ('price', float), ('active', bool), ('status', (':or', 'new', 'paid', 'shipped')), ('note', (':or', str, None))] * 5
+    sc = [{'{}-{}'.format(k, i): v for i, (k, v) in enumerate(columns)}]
+    row = {'{}-{}'.format(k, i): v for i, (k, v) in enumerate(zip([k for k, _ in columns], [1, 'item', 1.0, True, 'paid', None] * 5))}
+    value = [dict(row) for _ in range(5000)]
+    return lambda: schema.validate(sc, value)
+
+def bench_union_last():
+    sc = (':or',) + tuple({'kind': 'kind-{}'.format(i), 'value': int} for i in range(10))
+    value = {'kind': 'kind-9', 'value': 1}
+    return lambda: schema.validate(sc, value)
+
+def bench_predicate_keys():
+    sc = {lambda k: k.startswith('x-'): str, lambda k: k.startswith('y-'): int}
+    value = dict([('x-{}'.format(i), 'a') for i in range(25)] + [('y-{}'.format(i), i) for i in range(25)])
+    return lambda: schema.validate(sc, value)
+
+def bench_optional_defaults():
+    sc = {'name': str, **{'opt-{}'.format(i): (':optional', int, i) for i in range(20)}}
+    value = {'name': 'jane'}
+    return lambda: schema.validate(sc, value)
+
+def bench_array():
+    value = array.array('d', [i / 100000 for i in range(100000)])
+    return lambda: schema.validate([(':and', float, (':range', 0, 1))], value)
+
+def bench_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    value = numpy.linspace(0, 1, 100000)
+    return lambda: schema.validate([(':and', float, (':range', 0, 1))], value)
+
+def bench_set():
+    value = set(range(1000))
+    return lambda: schema.validate({int}, value)
+
+def bench_failing():
+    sc = {'user': {'name': str, 'age': int}, 'tags': [str]}
+    value = {'user': {'name': 'jane', 'age': 'old'}, 'tags': ['a']}
+    def run():
+        try:
+            schema.validate(sc, value)
+        except AssertionError:
+            pass
+        else:
+            raise Exception('expected failure')
+    return run
+
+def bench_is_valid_failing():
+    sc = {'user': {'name': str, 'age': int}, 'tags': [str]}
+    value = {'user': {'name': 'jane', 'age': 'old'}, 'tags': ['a']}
+    return lambda: schema.is_valid(sc, value)
+
+def bench_check_function():
+    @check
+    def fn(a: int, b: str, opts: {'verbose': (':optional', bool, False)}) -> str:
+        return b
+    return lambda: fn(1, 'b', {})
+
+def bench_check_generator():
+    @check(yields=int, sends=object)
+    def gen(n: int):
+        for i in range(n):
+            yield i
+    return lambda: sum(gen(100))
+
+def bench_check_async_generator():
+    @check(yields=int)
+    async def gen(n: int):
+        for i in range(n):
+            yield i
+    async def consume():
+        return [x async for x in gen(100)]
+    def run():
+        try:
+            consume().send(None)
+        except StopIteration as e:
+            return e.value
+    return run
+
+def bench_check_coroutine():
+    @check
+    async def fn(a: int, b: str) -> str:
+        return b
+    def run():
+        try:
+            fn(1, 'b').send(None)
+        except StopIteration as e:
+            return e.value
+    return run
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+benchmarks = {name[len('bench_'):]: fn for name, fn in sorted(globals().items()) if name.startswith('bench_')}
+
+def measure(fn, seconds):
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed > seconds / 5:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(4):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops': number / best, 'bytes': peak - current}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=1.0, help='approximate time per benchmark')
+    parser.add_argument('--only', help='run benchmarks whose name contains this')
+    parser.add_argument('--save', nargs='?', const=default_baseline, help='write results to this json file')
+    parser.add_argument('--compare', nargs='?', const=default_baseline, help='compare against results saved to this json file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown allowed by --compare')
+    args = parser.parse_args()
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = {}
+    regressions = []
+    print('{:<20} {:>14} {:>14} {:>10}'.format('benchmark', 'ops/sec', 'peak bytes/op', 'vs base'))
+    for name, setup in benchmarks.items():
+        if args.only and args.only not in name:
+            continue
+        fn = setup()
+        if fn is None: # an optional dependency is missing
+            continue
+        result = results[name] = measure(fn, args.seconds)
+        change = ''
+        if name in baseline:
+            ratio = result['ops'] / baseline[name]['ops']
+            change = '{:.2f}x'.format(ratio)
+            if ratio < 1 - args.tolerance:
+                regressions.append(name)
+                change += ' !'
+        print('{:<20} {:>14,.0f} {:>14,} {:>10}'.format(name, result['ops'], result['bytes'], change))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions:
+        print('slower than baseline: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,24 @@
+import array
+import asyncio
+import builtins
+import codecs
+import collections
+import concurrent.futures
 import functools
+import hashlib
+import importlib
+import importlib.util
 import inspect
+import itertools
+import json
+import math
+import marshal
+import multiprocessing
+import operator
+import pickle
 import pprint
 import re
+import reprlib
 import util.misc
 import util.dicts
 import util.exceptions
@@ -10,7 +27,11 @@ import util.func
 import util.strings
 import sys
 import traceback
+import threading
+import time
 import types
+import weakref
+import zlib
 import os
 
 disabled = os.environ.get('SCHEMA_DISABLE')
@@ -20,16 +41,97 @@ if disabled:
 _schema_commands = (':or',
                     ':and',
                     ':optional',
-                    ':fn')
+                    ':fn',
+                    ':range')
+
+class ValidationError(AssertionError):
+    """
+    raised when a value does not match a schema.
+
+    path is the list of keys and indices from the validated value to the
+    failure, and schema and value are the sub-schema and sub-value which
+    failed. reason is one of 'type', 'equal', 'predicate', 'length',
+    'missing-key', 'unknown-key', 'union', 'intersection', 'function',
+    'range' for a value outside a :range, 'schema' for a malformed schema, 'error' for an AssertionError raised
+    by a predicate, or 'errors' for validate(..., collect=True), in which
+    case errors is the list of every violation.
+
+    the message is only rendered by str(), with dumps of values truncated
+    to ValidationError.dump_size characters, which defaults to the
+    SCHEMA_ERROR_DUMP_SIZE env var or 4096.
+
+    >>> try:
+    ...     validate({'users': [{'name': str}]}, {'users': [{'name': 'jane'}, {'name': 1}]})
+    ... except ValidationError as e:
+    ...     error = e
+    >>> error.path, error.reason, error.schema, error.value
+    (['users', 1, 'name'], 'type', <class 'str'>, 1)
+    """
+    dump_size = int(os.environ.get('SCHEMA_ERROR_DUMP_SIZE', 4096))
+
+    def __init__(self, reason, schema, value, message, *args):
+        self.reason = reason
+        self.schema = schema
+        self.value = value
+        self.path = []
+        self.errors = []
+        self._message = message # a format string for args, or a function returning the message
+        self._args = args
+        self._contexts = []
+        self._rendered = None
+
+    def __str__(self):
+        if self._rendered is None:
+            if callable(self._message):
+                text = self._message()
+            elif self._args:
+                text = self._message.format(*map(_short, self._args))
+            else:
+                text = self._message
+            for schema, value in self._contexts:
+                text = _prettify(text + _helpful_message(schema, value))
+            self._rendered = text
+        return self._rendered
+
+    def __repr__(self):
+        return 'ValidationError({!r}, path={!r})'.format(self.reason, self.path)
+
+    def __reduce__(self):
+        return ValidationError, (self.reason, None, None, str(self)), {'path': self.path, 'errors': self.errors}
+
+    # util.exceptions.update reads and replaces args[0] to add context
+    @property
+    def args(self):
+        return (str(self),)
+
+    @args.setter
+    def args(self, args):
+        self._message = args[0] if args else ''
+        self._args = ()
+        self._contexts = []
+        self._rendered = None
+
+    def _context(self, schema, value, key):
+        if self._rendered is not None:
+            self.args = (self._rendered,)
+        if key is not _missing:
+            self.path.insert(0, key)
+        self._contexts.append((schema, value))
 
 def is_valid(schema, value):
+    """
+    like validate, but returns a bool. it never raises, copies or formats
+    anything, and stops at the first mismatch.
+
+    >>> assert is_valid([int], [1, 2])
+    >>> assert not is_valid([int], [1, '2'])
+    """
     try:
-        _validate(schema, value)
-        return True
+        return bool(_compiled(schema).ok(value))
     except AssertionError:
         return False
 
-def validate(schema, value, exact_match=False):
+def validate(schema, value, exact_match=False, copy=True, collect=False):
     """
     >>> import pytest
 
@@ -68,6 +170,19 @@ def validate(schema, value, exact_match=False):
     >>> with pytest.raises(AssertionError):
     ...     validate(schema, 'b-z')
 
+    ### ranges with :range are inclusive, with None for no bound
+    >>> schema = (':range', 0, 1)
+    >>> assert validate(schema, 0.5) == 0.5
+    >>> with pytest.raises(AssertionError):
+    ...     validate(schema, 2)
+
+    ### arrays, from numpy, array.array or memoryview, are vectorized and not copied by lists of number types and ranges
+    >>> import array
+    >>> values = array.array('d', [0.5, 1.0])
+    >>> assert validate([(':and', float, (':range', 0, 1))], values) is values
+    >>> with pytest.raises(AssertionError):
+    ...     validate([int], values)
+
     ### dicts can use types and values for k's and v's, and also lambdas for v'util.
 
     # dicts with types->types
@@ -112,6 +227,29 @@ def validate(schema, value, exact_match=False):
     >>> with pytest.raises(AssertionError):
     ...     validate(schema, {'users': [{'name': ('jane', 'e', 'smith'), 'id': 85}]})
 
+    ### validation without copying
+
+    # with copy=False, the value itself is returned when nothing needed to
+    # change, and only the sub-trees which did change are copied. sequences
+    # keep their type, instead of becoming lists.
+    >>> schema = {'users': [{'name': str, 'admin': (':optional', bool, False)}]}
+    >>> obj = {'users': [{'name': 'jane', 'admin': True}]}
+    >>> assert validate(schema, obj, copy=False) is obj
+    >>> obj = {'users': [{'name': 'jane', 'admin': True}, {'name': 'john'}]}
+    >>> new = validate(schema, obj, copy=False)
+    >>> assert new == {'users': [{'name': 'jane', 'admin': True}, {'name': 'john', 'admin': False}]}
+    >>> assert new is not obj and new['users'][0] is obj['users'][0]
+
+    ### collecting every error
+
+    # with collect=True, the whole value is validated before raising, and
+    # the error lists every violation with its path. this always copies.
+    >>> schema = {'name': str, 'email': lambda x: '@' in x}
+    >>> with pytest.raises(ValidationError) as e:
+    ...     validate(schema, {'name': 1, 'email': 'jane'}, collect=True)
+    >>> [x.path for x in e.value.errors]
+    [['name'], ['email']]
+
     ### schema based pattern matching
 
     # # with a combination of values and object, we can express complex assertions on data
@@ -125,118 +263,2243 @@ def validate(schema, value, exact_match=False):
     #     else:
     #         print('unknown message')
     #
+    # # with many patterns, Matcher indexes them and only tests those which can match
+    # on_msg = Matcher([((":order", {'sender': str, 'instructions': [str]}), run_order),
+    #                   ((":shutdown", object), lambda msg: sys.exit(1))],
+    #                  default=lambda msg: print('unknown message'))
+    # while True:
+    #     on_msg(socket.recv())
+    #
     """
-    if disabled:
+    state = _state
+    if state is not None:
+        if state is _profiled:
+            return _validate_profiled(schema, value, exact_match, copy, collect)
+        if state is _by_caller:
+            state = _caller_state()
+        if state is False:
+            return value
+        if state is not None and not state(value):
+            return _compiled(schema, defaults=True)(value)
+    if collect:
+        return _collect(schema, value, exact_match, copy)
+    return _validate(schema, value, exact_match, copy)
+
+def _validate(schema, value, exact_match=False, copy=True):
+    return _compiled(schema, exact_match, copy)(value)
+
+async def avalidate(schema, value, exact_match=False, copy=True, executor=None, offload_size=None):
+    """
+    like validate, but for coroutines. an awaitable or future value is
+    awaited, and its result validated, instead of being patched. values
+    larger than offload_size, roughly in bytes, and SCHEMA_OFFLOAD_SIZE by
+    default, are validated in executor, or the loop's default thread pool,
+    so the event loop is not blocked by large payloads. a process pool keeps
+    the event loop free of validation entirely, if schema and value pickle.
+
+    >>> import asyncio
+    >>> loop = asyncio.new_event_loop()
+    >>> future = loop.create_future()
+    >>> future.set_result({'a': 1})
+    >>> assert loop.run_until_complete(avalidate({'a': int}, future)) == {'a': 1}
+    >>> loop.close()
+    """
+    state = _state
+    if state is _by_caller:
+        state = _caller_state()
+    elif state is _profiled:
+        # the call site, and its state, are found here, since the caller is not on the stack of an executor thread
+        frame = sys._getframe(1)
+        profiled = _caller_state(), (frame.f_code, frame.f_lineno)
+    if inspect.isawaitable(value):
+        value = await value
+    elif isinstance(value, concurrent.futures.Future):
+        value = await asyncio.wrap_future(value)
+    if state is False:
         return value
-    return _validate(schema, value, exact_match)
-
-def _validate(schema, value, exact_match=False):
-    # maybe use ':type/<type>' instead of literal types? ie non jsonable stuff.
-    with util.exceptions.update(_updater(schema, value), AssertionError):
-        # TODO break this up into well named pieces
-        # TODO replace long lists of conditionals with type based lookup in dicts. falls back on isinstance based looks? ugh. subclasses.
-        value_is_a_future = util.misc.is_future(value)
-        schema_is_a_future_type = util.misc.is_future(schema) and type(schema) is type
-        if value_is_a_future and not schema_is_a_future_type:
-            _set_result = value.set_result
-            def f(x):
-                _set_result(_validate(schema, x))
-            value.set_result = f
+    if state is _profiled:
+        return await _offload(value, executor, offload_size, _validate_profiled, schema, value, exact_match, copy, False, *profiled)
+    if state is not None and not state(value):
+        return _compiled(schema, defaults=True)(value)
+    return await _offload(value, executor, offload_size, _validate, schema, value, exact_match, copy)
+
+async def _offload(value, executor, size, fn, *args):
+    # the size of value is estimated by a walk which stops at size, so small values cost little
+    if _small(value, _offload_size if size is None else size):
+        return fn(*args)
+    return await asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+
+def errors(schema, value, exact_match=False):
+    """
+    every violation of schema by value, found in one pass, as a list of
+    ValidationErrors with their paths. empty if the value is valid.
+
+    >>> schema = {'name': str, 'age': int, 'tags': [str]}
+    >>> [(e.path, e.reason) for e in errors(schema, {'name': 1, 'tags': ['a', 2, 3]})]
+    [(['name'], 'type'), (['tags', 1], 'type'), (['tags', 2], 'type'), (['age'], 'missing-key')]
+    """
+    _errors = []
+    _compiled(schema, exact_match).collect(value, [], _errors)
+    return _errors
+
+def _collect(schema, value, exact_match, copy):
+    _errors = []
+    value = _compiled(schema, exact_match, copy).collect(value, [], _errors)
+    if _errors:
+        error = ValidationError('errors', schema, value, lambda: '{} errors:\n\n{}'.format(len(_errors), '\n\n'.join(
+            'path: {}\n{}'.format(e.path, util.strings.indent(str(e), 2)) for e in _errors)))
+        error.errors = _errors
+        raise error
+    return value
+
+_missing = object()
+
+_cache_size = int(os.environ.get('SCHEMA_CACHE_SIZE', 1024))
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+_CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+_sources_lock = threading.Lock()
+_schema_sources = collections.OrderedDict()
+_function_sources = collections.OrderedDict()
+
+_codegen = bool(os.environ.get('SCHEMA_CODEGEN'))
+_offload_size = int(os.environ.get('SCHEMA_OFFLOAD_SIZE', 1 << 16))
+_codes = {} # generated source digest -> code, loaded by precompile
+
+_repr = reprlib.Repr()
+_repr.maxlevel = 6
+_repr.maxdict = _repr.maxlist = _repr.maxtuple = _repr.maxset = _repr.maxfrozenset = 50
+_repr.maxstring = _repr.maxother = 200
+
+_Results = collections.namedtuple('Results', ['values', 'errors'])
+
+_worker = None
+
+_modes = ['full', 'sampled', 'off', None]
+
+_mode_settings = {None: 'off'} if disabled else {}
+
+_sampler_settings = {}
+
+_settings_lock = threading.RLock()
+
+_checks = weakref.WeakSet()
+
+_resolved = {}
+
+_by_caller = object()
+
+_profiled = object()
+
+_profiling = False
+
+_profiles = {}
+
+_profiles_by_id = {}
+
+_profiles_by_site = {} # (code, line) of a call to validate -> its stats
+
+_validating = _state = False if disabled else None
+
+def validate_stream(schema, iterable, exact_match=False, copy=True, errors=None, workers=None, chunksize=1000):
+    """
+    validate an iterable against a list schema, [<schema>], lazily yielding
+    each validated element, so memory is bounded by one element. exact_match
+    applies to each element. failures raise with the index of the element,
+    or if errors is a list, are appended to it as (index, error) and skipped.
+
+    with workers=n, elements are validated in chunks of chunksize across n
+    worker processes, and yielded in order. see validate_many.
+
+    >>> import pytest
+    >>> assert list(validate_stream([int], iter([1, 2]))) == [1, 2]
+    >>> with pytest.raises(AssertionError):
+    ...     list(validate_stream([int], iter([1, '2'])))
+    >>> errors = []
+    >>> assert list(validate_stream([int], iter([1, '2', 3]), errors=errors)) == [1, 3]
+    >>> assert [i for i, _ in errors] == [1]
+    """
+    return _validate_items(schema, enumerate(iterable), exact_match, copy, errors, None, workers, chunksize)
+
+def validate_jsonl(schema, file_obj, exact_match=False, copy=True, errors=None, workers=None, chunksize=1000):
+    """
+    validate newline delimited json from a file object, in text or binary
+    mode, against a list schema, [<schema>], like validate_stream. blank
+    lines are skipped, and the index of an element is its line number,
+    starting from 0. lines which are not valid json are failures.
+
+    >>> import io
+    >>> assert list(validate_jsonl([{'a': int}], io.StringIO('{"a": 1}\\n\\n{"a": 2}\\n'))) == [{'a': 1}, {'a': 2}]
+    """
+    lines = ((i, line) for i, line in enumerate(file_obj) if line.strip())
+    return _validate_items(schema, lines, exact_match, copy, errors, _loads, workers, chunksize)
+
+def validate_json_array(schema, file_obj, exact_match=False, copy=True, errors=None, workers=None, chunksize=1000):
+    """
+    validate a json array from a file object, in text or binary mode, against
+    a list schema, [<schema>], like validate_stream. the array is decoded one
+    element at a time, so memory is bounded by one element.
+
+    >>> import io
+    >>> assert list(validate_json_array([int], io.StringIO('[1, 2, 3]'))) == [1, 2, 3]
+    """
+    return _validate_items(schema, enumerate(_json_array_items(file_obj)), exact_match, copy, errors, None, workers, chunksize)
+
+def validate_many(schema, values, exact_match=False, copy=True, mask=False, workers=None, chunksize=1000):
+    """
+    validate each of values against schema, compiling it once. this never
+    raises for invalid values, instead it returns (values, errors), the
+    validated values which passed and a list of (index, error) for those
+    which failed. with mask=True, returns a list of bools from the boolean
+    evaluator instead.
+
+    with workers=n, values are validated in chunks of chunksize across n
+    worker processes, and results keep the order of values. workers are
+    forked where possible, so the schema is inherited rather than pickled
+    and may contain lambdas. where fork is unavailable the schema must be
+    picklable.
+
+    >>> valid, errors = validate_many({'id': int}, [{'id': 1}, {'id': '2'}, {'id': 3}])
+    >>> assert valid == [{'id': 1}, {'id': 3}] and [i for i, _ in errors] == [1]
+    >>> assert validate_many(int, [1, '2', 3], mask=True) == [True, False, True]
+    """
+    if _caller_state() is False:
+        return [True for _ in values] if mask else _Results(list(values), [])
+    if workers:
+        errors = []
+        results = list(_parallel(schema, enumerate(values), exact_match, copy, errors, None, mask, workers, chunksize))
+        return results if mask else _Results(results, errors)
+    node = _compiled(schema, exact_match, copy)
+    if mask:
+        try:
+            return [bool(x) for x in map(node.ok, values)]
+        except AssertionError: # rare, from predicates which assert
+            return [is_valid(schema, value) for value in values]
+    errors = []
+    return _Results(list(_stream(node, enumerate(values), errors, None)), errors)
+
+def _validate_items(schema, items, exact_match, copy, errors, decode, workers, chunksize):
+    assert isinstance(schema, list) and len(schema) == 1, 'list schemas represent homogenous seqs and must contain a single schema: {}'.format(schema)
+    if _caller_state(3) is False:
+        return _stream(lambda value: value, items, errors, decode)
+    elif workers:
+        return _parallel(schema[0], items, exact_match, copy, errors, decode, False, workers, chunksize)
+    else:
+        return _stream(_compiled(schema[0], exact_match, copy), items, errors, decode)
+
+def _stream(node, items, errors, decode):
+    for i, value in items:
+        try:
+            if decode:
+                value = decode(value)
+            value = node(value)
+        except AssertionError as e:
+            if errors is None:
+                with util.exceptions.update('element num:\n  {}'.format(i), AssertionError):
+                    raise
+            errors.append((i, e))
+            continue
+        yield value
+
+def _parallel(schema, items, exact_match, copy, errors, decode, mask, workers, chunksize):
+    # the schema is handed to each worker as it starts. a bounded number of
+    # chunks are in flight, and results are yielded in the order of items.
+    pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=_mp_context(schema), initializer=_worker_init, initargs=(schema, exact_match, copy, decode, mask))
+    chunks = _chunks(items, chunksize)
+    pending = collections.deque()
+    def submit(n):
+        for chunk in itertools.islice(chunks, n):
+            pending.append(([i for i, _ in chunk], pool.submit(_worker_validate, chunk)))
+    try:
+        submit(workers * 2)
+        while pending:
+            indices, future = pending.popleft()
+            result = future.result()
+            submit(1)
+            if mask:
+                yield from result
+                continue
+            values, failures = result
+            if failures and errors is None:
+                i, e = failures[0]
+                yield from values[:indices.index(i)]
+                with util.exceptions.update('element num:\n  {}'.format(i), AssertionError):
+                    raise e
+            elif failures:
+                errors.extend(failures)
+            yield from values
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown()
+
+def _mp_context(schema):
+    # with fork the schema is inherited by workers instead of pickled, so it may contain lambdas
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    try:
+        pickle.dumps(schema)
+    except Exception as e:
+        raise AssertionError('without fork, schemas for worker processes must be picklable, not: {}\n  {}'.format(schema, e))
+    return multiprocessing.get_context()
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _worker_init(schema, exact_match, copy, decode, mask):
+    # compile without the cache, whose lock may have been held by another thread at fork
+    global _worker
+    _worker = _compile(schema, exact_match, copy), decode, mask
+
+def _worker_validate(chunk):
+    node, decode, mask = _worker
+    if mask:
+        return [_ok(node, value) for _, value in chunk]
+    errors = []
+    return list(_stream(node, chunk, errors, decode)), errors
+
+def _ok(node, value):
+    try:
+        return bool(node.ok(value))
+    except AssertionError:
+        return False
+
+def _loads(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise AssertionError('invalid json: {}\n  {}'.format(e, line[:120]))
+
+def _json_array_items(file_obj, size=1 << 16):
+    decode = json.JSONDecoder().raw_decode
+    read = _text_reader(file_obj)
+    buf = ''
+    pos = 0
+    state = '['
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            buf, pos = read(size), 0
+            if not buf:
+                raise ValueError('unexpected end of json array')
+            continue
+        char = buf[pos]
+        if state == '[':
+            if char != '[':
+                raise ValueError('expected a json array, not: {}'.format(buf[pos:pos + 20]))
+            pos += 1
+            state = 'first'
+        elif state in ['first', ','] and char == ']':
+            return
+        elif state == ',':
+            if char != ',':
+                raise ValueError('expected , or ] in json array, not: {}'.format(buf[pos:pos + 20]))
+            pos += 1
+            state = 'item'
+        else:
+            # an item is only complete once a delimiter follows it, since numbers can be split across
+            # reads. reads grow with the buffer, so a large item is decoded in linear time.
+            buf, pos = buf[pos:], 0
+            while True:
+                try:
+                    item, end = decode(buf)
+                except ValueError:
+                    end = None
+                if end is None or end == len(buf) or buf[end] not in ' \t\r\n,]':
+                    chunk = read(max(size, len(buf)))
+                    if chunk:
+                        buf += chunk
+                        continue
+                    elif end is None:
+                        item, end = decode(buf)
+                break
+            yield item
+            pos = end
+            state = ','
+
+def _text_reader(file_obj):
+    # reads text from file_obj, decoding utf-8 when it is binary
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    def read(size):
+        while True:
+            chunk = file_obj.read(size)
+            if not isinstance(chunk, bytes):
+                return chunk
+            text = decoder.decode(chunk, final=not chunk)
+            if text or not chunk:
+                return text
+    return read
+
+def match(value, patterns, exact_match=False, default=_missing):
+    """
+    call the handler of the first schema that value matches with the
+    validated value. patterns are [(schema, handler), ...]. to dispatch many
+    values, build a Matcher once and reuse it.
+
+    >>> match([':ping', 1], [((':ping', int), lambda msg: msg[1] + 1)])
+    2
+    """
+    return Matcher(patterns, exact_match, default)(value)
+
+class Matcher(object):
+    """
+    schema based pattern matching. calling the matcher with a value calls the
+    handler of the first schema it matches with the validated value, or
+    default with the value if none match. without a default, no match is an
+    AssertionError.
+
+    patterns are indexed on the leading keyword of tuple schemas, a required
+    key of dict schemas, and the types other schemas can match, so only the
+    patterns which could possibly match a value are tested.
+
+    >>> on_msg = Matcher([((':order', {'id': int}), lambda msg: 'order'),
+    ...                   ((':shutdown', object), lambda msg: 'shutdown'),
+    ...                   ({'id': int}, lambda msg: 'record')],
+    ...                  default=lambda msg: 'unknown')
+    >>> on_msg([':order', {'id': 1}])
+    'order'
+    >>> on_msg([':shutdown', None])
+    'shutdown'
+    >>> on_msg({'id': 1})
+    'record'
+    >>> on_msg([':order', {'id': '1'}])
+    'unknown'
+    """
+
+    def __init__(self, patterns, exact_match=False, default=_missing):
+        patterns = list(patterns)
+        self.schemas = [schema for schema, _ in patterns]
+        self.handlers = [handler for _, handler in patterns]
+        self.default = default
+        self._nodes = [_compiled(schema, exact_match) for schema in self.schemas]
+        self._keywords = {} # leading keyword -> [pattern index]
+        self._keys = {} # required dict key -> [pattern index]
+        self._generic = [] # everything else, filtered by type on lookup
+        self._by_type = {}
+        for i, schema in enumerate(self.schemas):
+            if _is_keyword_tuple(schema):
+                self._keywords.setdefault(schema[0], []).append(i)
+            elif isinstance(schema, dict) and _required_keys(schema):
+                self._keys.setdefault(_required_keys(schema)[0], []).append(i)
+            else:
+                self._generic.append(i)
+        self._all_keywords = sorted(i for x in self._keywords.values() for i in x)
+
+    def __call__(self, value):
+        if _is_future(value):
+            # futures match any schema but a future type, and are validated when resolved
+            candidates = range(len(self._nodes))
+        else:
+            candidates = self._candidates(value)
+        for i in candidates:
+            node = self._nodes[i]
+            try:
+                valid, futures = _probe(node.ok, value)
+            except AssertionError:
+                valid = False
+            if valid:
+                # futures are patched once, by the node, not by ok
+                return self.handlers[i](node(value) if futures or node.transforms and not _is_future(value) else value)
+        return self._no_match(value)
+
+    def _no_match(self, value):
+        if self.default is not _missing:
+            return self.default(value)
+        raise AssertionError(_prettify('{} <{}> did not match any of [{}]'.format(value, type(value), ', '.join('{} <{}>'.format(x, type(x)) for x in self.schemas))))
+
+    def _candidates(self, value):
+        tp = type(value)
+        try:
+            candidates = self._by_type[tp]
+        except KeyError:
+            candidates = self._by_type[tp] = [i for i in self._generic if _could_match_type(self.schemas[i], tp)]
+        if tp is list or tp is tuple:
+            if not value or not self._keywords:
+                return candidates
+            first = value[0]
+            if isinstance(first, bytes):
+                first = first.decode('utf-8')
+            try:
+                keyword = self._keywords.get(first)
+            except TypeError: # unhashable values are never equal to a keyword
+                return candidates
+            if keyword is None:
+                return candidates
+            return sorted(candidates + keyword)
+        elif isinstance(value, dict):
+            if not self._keys:
+                return candidates
+            if len(value) < len(self._keys):
+                found = [self._keys[k] for k in value if k in self._keys]
+            else:
+                found = [x for k, x in self._keys.items() if k in value]
+            if not found:
+                return candidates
+            return sorted(candidates + [i for x in found for i in x])
+        elif self._keywords and hasattr(tp, '__len__'):
+            # keyword tuples only require a sized value, so be conservative with anything else
+            return sorted(candidates + self._all_keywords)
+        else:
+            return candidates
+
+def _is_keyword_tuple(schema):
+    return isinstance(schema, tuple) and _starts_with_keyword(schema) and schema[0] not in _schema_commands
+
+def _required_keys(schema):
+    return [k for k, v in schema.items() if not (_is_optional(v) or isinstance(k, type) or isinstance(k, _predicate_types))]
+
+def _could_match_type(schema, tp):
+    # conservative, true unless no value of type tp can ever match schema
+    if util.misc.is_future(schema) and type(schema) is type:
+        return True
+    elif isinstance(schema, set):
+        return issubclass(tp, set)
+    elif isinstance(schema, dict):
+        return issubclass(tp, dict)
+    elif isinstance(schema, (list, tuple)) and not _starts_with_keyword(schema):
+        return issubclass(tp, (list, tuple)) or isinstance(schema, list) and len(schema) == 1 and _is_array_type(tp) and _vector_parts(schema[0]) is not None
+    elif isinstance(schema, type) and type(schema) is type and schema is not object:
+        return issubclass(tp, schema)
+    else:
+        return True
+
+_plain_types = {int, float, complex, str, bytes, bool, type(None), dict, list, tuple, set, frozenset}
+
+_predicate_types = (types.FunctionType, type(callable))
+
+_immutable_types = {int, float, complex, str, bytes, bool, type(None)}
+
+
+def set_mode(mode, scope=None):
+    """
+    turn checking on or off at runtime for validate and check.
+
+    mode is one of:
+      'full': check every call.
+      'sampled': check the calls sampled by set_sampling, which is every
+                 call when no sampling has been set.
+      'off': check nothing, not even :optional defaults are filled in.
+      None: use the mode of the enclosing scope.
+
+    scope is None for everything, a module or package name like
+    'myapp.orders', which applies to checked functions defined in it and
+    to validate called from it, or a function decorated with check. the
+    most specific scope wins. a checked function which is off costs one
+    attribute read per call. when no mode is set, calls are sampled, and
+    SCHEMA_DISABLE sets the mode of everything to 'off' at import.
+
+    >>> import pytest
+    >>> @check
+    ... def fn(x: int) -> int:
+    ...     return x
+    >>> set_mode('off', scope=fn.__module__)
+    >>> assert fn('1') == '1'
+    >>> set_mode(None, scope=fn.__module__)
+    >>> with pytest.raises(AssertionError):
+    ...     fn('1')
+    """
+    assert mode in _modes, 'mode must be one of {}, not: {}'.format(sorted(_modes, key=str), mode)
+    _set(_mode_settings, scope, 'mode', mode)
+
+def set_sampling(every=None, per_second=None, key=None, scope=None):
+    """
+    check only a sample of calls, either 1 in every calls, or up to
+    per_second calls each second. with key, calls are sampled
+    deterministically by crc32(str(key(*args, **kwargs))) % every, ie to
+    always check the same users. key is called with the value for
+    validate, and with the arguments of the call for check.
+
+    calls which are not sampled are not checked, but still have :optional
+    defaults filled in. unions and intersections containing defaults are
+    always validated, since the defaults which apply depend on which of
+    their schemas match.
+
+    scope is as for set_mode. sampling applies in the 'sampled' mode, the
+    default. with no arguments, sampling is removed for scope. this can be
+    changed at any time.
+
+    >>> import pytest
+    >>> schema = {'name': str, 'age': (':optional', int, 0)}
+    >>> set_sampling(every=2)
+    >>> with pytest.raises(AssertionError):
+    ...     validate(schema, {'name': 123}) # checked
+    >>> assert validate(schema, {'name': 123}) == {'name': 123, 'age': 0} # not checked
+    >>> set_sampling()
+    """
+    sampler = None if every is None and per_second is None else _make_sampler(every, per_second, key)
+    _set(_sampler_settings, scope, 'sampler', sampler)
+
+def _set(settings, scope, attr, value):
+    with _settings_lock:
+        if scope is None or isinstance(scope, str):
+            if value is None:
+                settings.pop(scope, None)
+            else:
+                settings[scope] = value
+        else:
+            assert hasattr(scope, '_checking'), 'scope must be None, a module name, or a function decorated with check, not: {}'.format(scope)
+            setattr(scope._checking, attr, value)
+        _update()
+
+def _update():
+    global _state, _validating
+    with _settings_lock:
+        for checking in list(_checks):
+            checking.update()
+        _resolved.clear()
+        scoped = any(k is not None for k in itertools.chain(_mode_settings, _sampler_settings))
+        _validating = _by_caller if scoped else _resolve(None)
+        _state = _profiled if _profiling and _validating is not False else _validating
+
+def _setting(settings, module):
+    while module:
+        if module in settings:
+            return settings[module]
+        module = module.rpartition('.')[0]
+    return settings.get(None)
+
+def _resolve(module, mode=None, sampler=None):
+    # None checks every call, False checks nothing, otherwise a sampler
+    mode = mode or _setting(_mode_settings, module) or 'sampled'
+    if mode == 'off':
+        return False
+    elif mode == 'full':
+        return None
+    return sampler or _setting(_sampler_settings, module)
+
+def _caller_state(depth=2):
+    state = _validating
+    if state is _by_caller:
+        module = sys._getframe(depth).f_globals.get('__name__')
+        try:
+            state = _resolved[module]
+        except KeyError:
+            state = _resolved[module] = _resolve(module)
+    return state
+
+def _make_sampler(every, per_second, key):
+    assert (every is None) != (per_second is None), 'sample with one of every=<n> or per_second=<n>, not both'
+    assert key is None or every is not None, 'sampling by key needs every=<n>'
+    if key is not None:
+        return lambda *a, **kw: zlib.crc32(str(key(*a, **kw)).encode('utf-8')) % every == 0
+    elif every is not None:
+        counter = itertools.count()
+        return lambda *a, **kw: next(counter) % every == 0
+    else:
+        window = [0.0, 0] # start, count
+        def sample(*a, **kw):
+            now = time.monotonic()
+            if now - window[0] >= 1:
+                window[0], window[1] = now, 0
+            window[1] += 1
+            return window[1] <= per_second
+        return sample
+
+class _Checking(object):
+    # the state of one decorated function, so runtime changes cost each call one attribute read.
+    # while profiling, calls go to a variant built with timed checks, which reads its state from inner.
+    __slots__ = ['state', 'module', 'mode', 'sampler', 'inner', 'build', 'profiled', '__weakref__']
+
+    def __init__(self, module):
+        self.module = module
+        self.mode = None
+        self.sampler = None
+        self.inner = _Checking.__new__(_Checking)
+        self.build = None
+        self.profiled = None
+        with _settings_lock:
+            self.update()
+            _checks.add(self)
+
+    def update(self):
+        state = self.inner.state = _resolve(self.module, self.mode, self.sampler)
+        self.state = _profiled if _profiling and state is not False else state
+
+    def profile(self):
+        self.profiled = self.build()
+        return self.profiled
+
+def profile(enabled=True):
+    """
+    record statistics for validate and check, see stats. this costs nothing
+    when disabled, and a pair of timer reads per validation when enabled.
+    """
+    global _profiling
+    with _settings_lock:
+        _profiling = enabled
+        _update()
+
+def stats(clear=False):
+    """
+    statistics recorded while profiling, by name, as json serializable dicts.
+    validate is named by the file and line of its first call with a schema,
+    and check by the name of the function, with parts for returns, yields
+    and sends. times are in seconds, and the percentiles are over the most
+    recent 1000 calls. nodes is the number of nodes in the schema.
+
+    >>> profile()
+    >>> schema = {'name': str, 'tags': [str]}
+    >>> _ = validate(schema, {'name': 'jane', 'tags': ['a']})
+    >>> profile(False)
+    >>> [result] = stats(clear=True).values()
+    >>> assert result['calls'] == 1 and result['failures'] == 0 and result['nodes'] == 4
+    >>> sorted(result)
+    ['calls', 'failures', 'nodes', 'p50', 'p99', 'total']
+    """
+    with _settings_lock:
+        results = {name: entry.dump() for name, entry in _profiles.items()}
+        if clear:
+            _profiles.clear()
+            _profiles_by_id.clear()
+            _profiles_by_site.clear()
+            for checking in list(_checks):
+                checking.profiled = None
+    return results
+
+class _Stats(object):
+    __slots__ = ['nodes', 'calls', 'failures', 'total', 'times']
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.calls = self.failures = 0
+        self.total = 0.0
+        self.times = collections.deque(maxlen=1000)
+
+    def dump(self):
+        times = sorted(self.times)
+        return {'calls': self.calls,
+                'failures': self.failures,
+                'total': self.total,
+                'p50': times[int(len(times) * .5)] if times else None,
+                'p99': times[int(len(times) * .99)] if times else None,
+                'nodes': self.nodes}
+
+def _stats_entry(name, *schemas):
+    with _settings_lock:
+        if name not in _profiles:
+            _profiles[name] = _Stats(sum(map(_count_nodes, schemas)))
+        return _profiles[name]
+
+def _count_nodes(schema):
+    if isinstance(schema, dict):
+        return 1 + sum(_count_nodes(v) + (_count_nodes(k) if isinstance(k, (type,) + _predicate_types) else 0) for k, v in schema.items())
+    elif isinstance(schema, set):
+        return 1 + sum(map(_count_nodes, schema))
+    elif isinstance(schema, (list, tuple)) and schema and schema[0] in _schema_commands:
+        if schema[0] == ':optional':
+            return _count_nodes(schema[1])
+        elif schema[0] in [':or', ':and']:
+            return 1 + sum(map(_count_nodes, schema[1:]))
+        return 1
+    elif isinstance(schema, (list, tuple)):
+        return 1 + sum(map(_count_nodes, schema))
+    return 1
+
+def _timed(fn, stats):
+    perf_counter = time.perf_counter
+    def timed(*a):
+        start = perf_counter()
+        try:
+            return fn(*a)
+        except AssertionError:
+            stats.failures += 1
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            stats.calls += 1
+            stats.total += elapsed
+            stats.times.append(elapsed)
+    return timed
+
+def _validate_profiled(schema, value, exact_match, copy, collect=False, state=_missing, site=None):
+    # state and call site are those of the caller of validate, unless they are passed by avalidate
+    if state is _missing:
+        state = _caller_state(3)
+    if state is False:
+        return value
+    if state is not None and not state(value):
+        return _compiled(schema, defaults=True)(value)
+    entry = _profiles_by_id.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        stats = entry[1]
+    else:
+        # schemas built inline on every call are found by their call site, which is only named once
+        if site is None:
+            frame = sys._getframe(2)
+            site = frame.f_code, frame.f_lineno
+        stats = _profiles_by_site.get(site)
+        if stats is None:
+            code, line = site
+            stats = _stats_entry('{}:{}'.format(code.co_filename, line), schema)
+            with _settings_lock:
+                if len(_profiles_by_id) >= _cache_size:
+                    _profiles_by_id.clear()
+                    _profiles_by_site.clear()
+                _profiles_by_id[id(schema)] = schema, stats
+                _profiles_by_site[site] = stats
+    start = time.perf_counter()
+    try:
+        if collect:
+            return _collect(schema, value, exact_match, copy)
+        return _validate(schema, value, exact_match, copy)
+    except AssertionError:
+        stats.failures += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.calls += 1
+        stats.total += elapsed
+        stats.times.append(elapsed)
+
+def compile(schema, exact_match=False, copy=True):
+    """
+    analyze a schema once and return a validator, fn(value) -> value, which
+    has the same semantics, return values and errors as validate().
+
+    >>> import pytest
+    >>> fn = compile({'name': str, 'age': (':optional', int, 0)})
+    >>> assert fn({'name': 'jane'}) == {'name': 'jane', 'age': 0}
+    >>> with pytest.raises(AssertionError):
+    ...     fn({'name': 123})
+
+    # fn.ok is the boolean form used by is_valid
+    >>> assert not fn.ok({'name': 123})
+
+    """
+    if disabled:
+        return _node(lambda value: value, lambda value: True, False, lambda value, path, errors: value)
+    return _compiled(schema, exact_match, copy)
+
+def generate(schema, exact_match=False):
+    """
+    compile a schema to python source, for the fastest validation of hot
+    schemas. the validator behaves exactly like compile(schema, exact_match),
+    since any value which fails, and any part of a schema without a generated
+    form, is validated by compile instead. the source is fn.source.
+
+    with the SCHEMA_CODEGEN env var set, validate generates every schema.
+
+    >>> fn = generate({'name': str, 'tags': [str], 'age': (':optional', int, 0)})
+    >>> assert fn({'name': 'jane', 'tags': ['a']}) == {'name': 'jane', 'tags': ['a'], 'age': 0}
+    >>> assert 'isinstance' in fn.source
+    """
+    return _generate(schema, exact_match)
+
+def precompile(module, write=True):
+    """
+    generate validators for every public schema in a module, a dict, list,
+    tuple or set, and cache them for validate, is_valid and check. like
+    bytecode, the compiled code is saved in __pycache__, and loaded from
+    there while the module, this library and python are unchanged. returns
+    the path of the saved code.
+
+    to warm the cache during a deploy:
+
+        python -m schema compile mypkg.schemas
+
+    then at startup, in every worker:
+
+        schema.precompile('mypkg.schemas')
+    """
+    if isinstance(module, str):
+        module = importlib.import_module(module)
+    path = os.path.splitext(importlib.util.cache_from_source(module.__file__))[0] + '.schema'
+    key = _precompiled_key(module.__file__)
+    codes = _load_codes(path, key)
+    _codes.update(codes)
+    generated = {}
+    for name, value in sorted(vars(module).items()):
+        if name.startswith('_') or not isinstance(value, (dict, list, tuple, set)):
+            continue
+        try:
+            fn = _generate(value, False)
+        except Exception: # not a schema
+            continue
+        try:
+            frozen = (_freeze(value), False, True, False)
+            hash(frozen)
+        except TypeError:
+            frozen = None
+        _cache_put((id(value), False, True, False), frozen, value, fn)
+        digest, generated[digest] = fn._code
+    if write and generated.keys() != codes.keys():
+        _save_codes(path, key, generated)
+    return path
+
+def cache_info():
+    """
+    statistics for the compiled schema cache used by validate, is_valid and compile.
+    """
+    with _cache_lock:
+        return _CacheInfo(_cache_stats['hits'], _cache_stats['misses'], _cache_size, len(_cache))
+
+def cache_clear():
+    """
+    clear the compiled schema cache. schemas are assumed not to be mutated
+    after first use, if you must mutate one, clear the cache afterwards.
+    """
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats['hits'] = _cache_stats['misses'] = 0
+
+def _compiled(schema, exact_match=False, copy=True, defaults=False):
+    # lookup by identity first, which is nearly always a hit for module level
+    # schemas. entries hold a reference to their schema, so an id cannot be
+    # reused while cached. schemas built inline on every call miss on identity
+    # and fall back to a structural key.
+    key = (id(schema), exact_match, copy, defaults)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] is schema:
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return entry[1]
+    try:
+        frozen = (_freeze(schema), exact_match, copy, defaults)
+        with _cache_lock:
+            entry = _cache.get(frozen)
+            if entry is not None:
+                _cache.move_to_end(frozen)
+                _cache_stats['hits'] += 1
+                return entry[1]
+    except TypeError: # unhashable literals can only be compiled, not cached
+        frozen = None
+    if defaults:
+        fn = _compile_defaults(schema)
+    elif _codegen and copy:
+        fn = _generate(schema, exact_match)
+    else:
+        fn = _compile(schema, exact_match, copy)
+    with _cache_lock:
+        _cache_stats['misses'] += 1
+    _cache_put(key, frozen, schema, fn)
+    return fn
+
+def _cache_put(key, frozen, schema, fn):
+    with _cache_lock:
+        _cache[key] = schema, fn
+        if frozen is not None:
+            _cache[frozen] = schema, fn
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+
+def _precompiled_key(path):
+    # the source of the module and of this library, since both decide the generated code
+    digests = []
+    for file in [path, __file__]:
+        with open(file, 'rb') as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+    return tuple(digests)
+
+def _load_codes(path, key):
+    try:
+        with open(path, 'rb') as f:
+            _key, codes = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    return codes if _key == key else {}
+
+def _save_codes(path, key, codes):
+    # written to a temporary file and renamed, since many workers may start at once. like
+    # bytecode, a read only install is not an error, the code is just compiled at startup.
+    temp = '{}.{}'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp, 'wb') as f:
+            marshal.dump((key, codes), f)
+        os.replace(temp, path)
+    except OSError:
+        pass
+
+def _freeze(schema):
+    # a hashable structural key, which keeps the type of literals since 1 == 1.0 == True
+    if isinstance(schema, dict):
+        return type(schema), tuple((_freeze(k), _freeze(v)) for k, v in schema.items())
+    elif isinstance(schema, (list, tuple)):
+        return type(schema), tuple(_freeze(x) for x in schema)
+    elif isinstance(schema, set):
+        return type(schema), tuple(_freeze(x) for x in schema)
+    elif type(schema) is types.FunctionType:
+        # lambdas built inline are new on every call, so they are keyed by what they would do.
+        # captured functions are kept by identity, since a function can capture itself.
+        try:
+            cells = tuple(x if type(x) is types.FunctionType else _freeze(x)
+                          for x in (c.cell_contents for c in schema.__closure__ or ()))
+        except ValueError: # an empty cell
+            return type(schema), schema
+        return type(schema), schema.__code__, _freeze(schema.__defaults__), _freeze(schema.__kwdefaults__), cells
+    else:
+        return type(schema), schema
+
+def _compile_defaults(schema):
+    # for calls which are not sampled. only :optional defaults are filled in and nothing is checked,
+    # except for unions and intersections containing defaults, which must validate to choose them.
+    return _defaults(schema) or (lambda value: value)
+
+def _defaults(schema):
+    if isinstance(schema, dict):
+        return _dict_defaults(schema)
+    elif isinstance(schema, (list, tuple)) and schema and schema[0] in _schema_commands:
+        if schema[0] == ':optional' and len(schema) == 3:
+            return _defaults(schema[1])
+        elif schema[0] in [':or', ':and'] and any(_defaults(x) for x in schema[1:]):
+            return _compile(schema)
+    elif isinstance(schema, list) and len(schema) == 1:
+        fn = _defaults(schema[0])
+        if fn:
+            return lambda value: [fn(x) for x in value] if isinstance(value, (list, tuple)) else value
+    elif isinstance(schema, tuple):
+        fns = [_defaults(x) for x in schema]
+        if any(fns):
+            return lambda value: [fn(x) if fn else x for fn, x in zip(fns, value)] if isinstance(value, (list, tuple)) else value
+
+def _dict_defaults(schema):
+    children = {}
+    optional = []
+    for k, v in schema.items():
+        fn = _defaults(v)
+        if fn and (isinstance(k, type) or isinstance(k, _predicate_types)):
+            return _compile(schema) # which keys a default applies to depends on validating them
+        elif fn:
+            children[k] = fn
+        if _is_optional(v) and len(v) == 3:
+            node = _compile(v[1])
+            optional.append((k, node, v[2], _default(node, v[2])))
+    if not children and not optional:
+        return None
+    def fill(value):
+        if not isinstance(value, dict):
             return value
-        elif isinstance(schema, set):
-            assert isinstance(value, set), '{} <{}> does not match schema: {} <{}>'.format(value, type(value), schema, type(schema))
-            assert len(schema) == 1, 'set schemas represent homogenous sets and must contain a single schema: {}'.format(schema)
-            return {_validate(list(schema)[0], x) for x in value}
-        elif isinstance(schema, dict):
-            assert isinstance(value, dict), '{} <{}> does not match schema: {} <{}>'.format(value, type(value), schema, type(schema))
-            # if schema keys are all types, and _value is empty, return. ie, type keys are optional, so {} is a valid {int: int}
-            if value == {} and {type(x) for x in schema} == {type}:
+        changes = None
+        for k, fn in children.items():
+            if k in value:
+                v = value[k]
+                _v = fn(v)
+                if _v is not v:
+                    changes = changes or {}
+                    changes[k] = _v
+        missing = [x for x in optional if x[0] not in value]
+        if changes is None and not missing:
+            return value
+        _value = value.copy()
+        if changes:
+            _value.update(changes)
+        for k, node, default, validated in missing:
+            _value[k] = node(default) if validated is _missing else validated
+        return _value
+    return fill
+
+def _compile(schema, exact_match=False, copy=True):
+    # every node is a validator, run(value) -> value, which raises AssertionError. it
+    # also carries run.ok(value) -> bool, which never raises or copies,
+    # run.collect(value, path, errors) -> value, which appends every violation to errors
+    # instead of raising, and always copies, and run.transforms, which is false if run
+    # always returns the value it was given.
+    # with copy=False, containers are only copied when their contents change.
+    # futures are checked first at every node, unless the schema is itself a future type.
+    futures = not (util.misc.is_future(schema) and type(schema) is type)
+    if isinstance(schema, set):
+        return _compile_set(schema, copy, futures)
+    elif isinstance(schema, dict):
+        return _compile_dict(schema, exact_match, copy, futures)
+    elif schema is object:
+        return _compile_object(schema, futures)
+    elif isinstance(schema, (list, tuple)):
+        return _compile_seq(schema, copy, futures)
+    elif isinstance(schema, type):
+        return _compile_type(schema, futures)
+    elif isinstance(schema, _predicate_types):
+        return _compile_predicate(schema, futures)
+    else:
+        return _compile_literal(schema, futures)
+
+def _node(run, ok, transforms, collect):
+    run.ok = ok
+    run.transforms = transforms
+    run.collect = collect
+    return run
+
+def _error(errors, path, reason, schema, value, message, *args):
+    error = ValidationError(reason, schema, value, message, *args)
+    error.path = list(path)
+    error._contexts.append((schema, value))
+    errors.append(error)
+
+def _is_future(value):
+    return type(value) not in _plain_types and util.misc.is_future(value)
+
+class _Local(threading.local):
+    def __init__(self):
+        # active is set while a value is probed by ok or locate, so its futures are left unpatched, and
+        # futures when a probe sees one. a plain namespace, since thread local attributes are slow to set
+        self.probing = types.SimpleNamespace(active=False, futures=False)
+
+_local = _Local()
+
+def _future(run, value):
+    probing = _local.probing
+    if probing.active:
+        probing.futures = True
+        return value
+    _set_result = value.set_result
+    def f(x):
+        _set_result(run(x))
+    value.set_result = f
+    return value
+
+def _probe(ok, value):
+    # ok, and whether it saw futures. they are left unpatched, so the node chosen by ok patches them once
+    if type(value) in _immutable_types:
+        return ok(value), False
+    probing = _local.probing
+    active, futures = probing.active, probing.futures
+    probing.active = True
+    probing.futures = False
+    try:
+        return ok(value), probing.futures
+    finally:
+        probing.active = active
+        probing.futures = futures or probing.futures
+
+def _compile_set(schema, copy, futures):
+    if len(schema) == 1:
+        node = _compile(list(schema)[0], copy=copy)
+        node_ok = node.ok
+    else:
+        node = None
+    def run(value):
+        try:
+            if futures and _is_future(value):
+                return _future(run, value)
+            if not isinstance(value, set):
+                raise ValidationError('type', schema, value, '{} <{}> does not match schema: {} <{}>', value, type(value), schema, type(schema))
+            if not node:
+                raise ValidationError('schema', schema, value, 'set schemas represent homogenous sets and must contain a single schema: {}', schema)
+            if copy:
+                return {node(x) for x in value}
+            elif not node.transforms:
+                for x in value:
+                    node(x)
                 return value
             else:
+                _value = {node(x) for x in value}
+                return value if _value == value else _value
+        except AssertionError:
+            _reraise(schema, value)
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+            return True
+        return isinstance(value, set) and node is not None and all(map(node_ok, value))
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(run, value)
+        if not isinstance(value, set):
+            _error(errors, path, 'type', schema, value, '{} <{}> does not match schema: {} <{}>', value, type(value), schema, type(schema))
+        elif not node:
+            _error(errors, path, 'schema', schema, value, 'set schemas represent homogenous sets and must contain a single schema: {}', schema)
+        else:
+            return {node.collect(x, path, errors) for x in value}
+        return value
+    return _node(run, ok, True, collect)
+
+def _compile_dict(schema, exact_match, copy, futures):
+    # index the schema once, so dispatch per key is a dict lookup in the common case,
+    # with value keys taking precedence over type keys, then predicate keys, then object
+    nodes = {k: _compile(v, copy=copy) for k, v in schema.items()}
+    oks = {k: node.ok for k, node in nodes.items()}
+    type_nodes = {k: nodes[k] for k in schema if isinstance(k, type)}
+    predicate_nodes = [(k, nodes[k]) for k in schema if isinstance(k, _predicate_types)]
+    object_node = nodes.get(object)
+    only_type_keys = {type(x) for x in schema} == {type}
+    required = set()
+    optional = []
+    for k, v in schema.items():
+        if _is_optional(v):
+            if len(v) == 3:
+                node = _compile(v[1], copy=copy)
+                optional.append((k, node, v[2], _default(node, v[2])))
+            else:
+                required.add(k) # malformed, reported if missing
+        elif not (isinstance(k, type) or isinstance(k, _predicate_types)):
+            required.add(k)
+    if not type_nodes and not predicate_nodes and object_node is None:
+        resolve = lambda k: None
+    else:
+        def resolve(k):
+            node = type_nodes.get(type(k))
+            if node is None:
+                for f, _node in predicate_nodes:
+                    if f(k):
+                        return _node
+                return object_node
+            return node
+    if copy:
+        def run(value):
+            try:
+                if futures and _is_future(value):
+                    return _future(_compiled(schema, copy=copy) if exact_match else run, value)
+                if not isinstance(value, dict):
+                    raise ValidationError('type', schema, value, '{} <{}> does not match schema: {} <{}>', value, type(value), schema, type(schema))
+                # if schema keys are all types, and _value is empty, return. ie, type keys are optional, so {} is a valid {int: int}
+                if not value and only_type_keys:
+                    return value
                 # check for items in value that dont satisfy schema, dropping unknown keys unless exact_match=true
-                # TODO update to conform to clj-schema. value, type, etc now deprecated.
-                _value = value.copy()
-                _value.clear()
+                if type(value) is dict:
+                    _value = {}
+                else:
+                    _value = value.copy()
+                    _value.clear()
                 for k, v in value.items():
-                    value_match = k in schema
-                    type_match = type(k) in [x for x in schema if isinstance(x, type)] # TODO sort this comprehension for consistent results?
-                    predicate_match = (list(filter(lambda f: f(k) and f, [x for x in schema if isinstance(x, (types.FunctionType, type(callable)))])) or [False])[0] # TODO sort this comprehension for consistent results?
-                    any_match = object in schema
-                    if value_match or type_match or predicate_match or any_match:
-                        _schema = schema[k if value_match else
-                                         type(k) if type_match else
-                                         predicate_match if predicate_match else
-                                         object]
-                        _value[k] = _validate(_schema, v)
+                    node = nodes.get(k) or resolve(k)
+                    if node is not None:
+                        _value[k] = node(v)
                     elif exact_match:
-                        raise AssertionError('{} <{}> does not match schema keys: {}'.format(k, type(k), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema])))
+                        raise ValidationError('unknown-key', schema, value, '{} <{}> does not match schema keys: {}', k, type(k), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema]))
                 # check for items in schema missing in value, filling in optional value
-                for k, v in schema.items():
+                if not _value.keys() >= required:
+                    _missing_keys(schema, _value)
+                for k, node, default, validated in optional:
                     if k not in _value:
-                        if isinstance(v, (list, tuple)) and v and v[0] == ':optional':
-                            assert len(v) == 3, ':optional schema should be [:optional, schema, default-value], not: {}'.format(v)
-                            _value[k] = _validate(*v[1:])
-                        elif not (isinstance(k, type) or isinstance(k, (types.FunctionType, type(callable)))):
-                            raise AssertionError('{} <{}> is missing required key: {} <{}>'.format(_value, type(_value), k, type(k)))
+                        _value[k] = node(default) if validated is _missing else validated
                 return _value
-        elif schema is object:
-            return value
-        # TODO flatten this into un-nested conditionals. perf hit?
-        elif isinstance(schema, (list, tuple)):
-            assert isinstance(value, (list, tuple)) or _starts_with_keyword(schema), '{} <{}> is not a seq: {} <{}>'.format(value, type(value), schema, type(schema))
-            if schema and schema[0] in _schema_commands:
-                if schema[0] == ':optional':
-                    assert len(schema) == 3, ':optional schema should be [:optional, schema, default-value], not: {}'.format(schema)
-                    return _validate(schema[1], value)
-                elif schema[0] == ':or':
-                    assert schema[1:], 'union types cannot be empty: {}'.format(schema)
-                    tracebacks = []
-                    for _schema in schema[1:]:
-                        try:
-                            value = _validate(_schema, value)
-                        except AssertionError:
-                            tracebacks.append(traceback.format_exc())
-                    if len(tracebacks) == len(schema[1:]):
-                        raise AssertionError('{} <{}> did not match *any* of [{}]\n{}'.format(value, type(value), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema[1:]]), '\n'.join(tracebacks)))
-                    else:
-                        return value
-                elif schema[0] == ':and':
-                    assert schema[1:], 'intersection types cannot be empty: {}'.format(schema)
-                    tracebacks = []
-                    for _schema in schema[1:]:
-                        try:
-                            value = _validate(_schema, value)
-                        except AssertionError:
-                            tracebacks.append(traceback.format_exc())
-                    if tracebacks:
-                        raise AssertionError('{} <{}> did not match *all* of [{}]\n{}'.format(value, type(value), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema[1:]]), '\n'.join(tracebacks)))
+            except AssertionError:
+                _reraise(schema, value, locate)
+    else:
+        def run(value):
+            try:
+                if futures and _is_future(value):
+                    return _future(_compiled(schema, copy=copy) if exact_match else run, value)
+                if not isinstance(value, dict):
+                    raise ValidationError('type', schema, value, '{} <{}> does not match schema: {} <{}>', value, type(value), schema, type(schema))
+                if not value and only_type_keys:
+                    return value
+                # validate into changes, so the value is only copied if some item changed or was dropped
+                changes = None
+                for k, v in value.items():
+                    node = nodes.get(k) or resolve(k)
+                    if node is not None:
+                        _v = node(v)
+                        if _v is not v:
+                            changes = changes or {}
+                            changes[k] = _v
+                    elif exact_match:
+                        raise ValidationError('unknown-key', schema, value, '{} <{}> does not match schema keys: {}', k, type(k), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema]))
                     else:
-                        return value
-                elif schema[0] == ':fn':
-                    assert isinstance(value, types.FunctionType), '{} <{}> is not a function'.format(value, type(value))
-                    assert len(schema) in [2, 3], ':fn schema should be (:fn, [<args>...], {<kwargs>: <val>, ...}) or (:fn, [<args>...]), not: {}'.format(schema)
-                    args, kwargs = schema[1:]
-                    _args, _kwargs = value._schema # TODO have a sane error message here when ._schema undefined
-                    assert tuple(_args) == tuple(args), 'pos args {_args} did not match {args}'.format(**locals())
-                    assert _kwargs == kwargs, 'kwargs {_kwargs} did not match {kwargs}'.format(**locals())
+                        changes = changes or {}
+                        changes[k] = _missing
+                if value.keys() >= required and changes is None and all(k in value for k, _, _, _ in optional):
                     return value
-            elif isinstance(schema, list):
-                assert len(schema) == 1, 'list schemas represent homogenous seqs and must contain a single schema: {}'.format(schema)
-                return [_validate(schema[0], v) for v in value]
-            elif isinstance(schema, tuple):
-                assert len(schema) == len(value), '{} <{}> mismatched length of schema: {} <{}>'.format(value, type(value), schema, type(schema))
-                return [_validate(_schema, _value) for _schema, _value in zip(schema, value)]
-        elif isinstance(schema, type):
-            assert isinstance(value, schema), '{} <{}> is not a: {} <{}>'.format(value, type(value), schema, type(schema))
+                _value = _apply_changes(value, changes)
+                if not _value.keys() >= required:
+                    _missing_keys(schema, _value)
+                for k, node, default, validated in optional:
+                    if k not in _value:
+                        _value[k] = node(default) if validated is _missing else validated
+                return _value
+            except AssertionError:
+                _reraise(schema, value, locate)
+    def locate(value):
+        for k, v in value.items():
+            node = nodes.get(k) or resolve(k)
+            if node is None:
+                if exact_match:
+                    return k
+            elif not _is_future(v) and not node.ok(v):
+                return k
+        return _missing
+    run.nodes = nodes # the columns of lists of records are validated by these
+    def ok(value):
+        if futures and _is_future(value):
+            run(value)
+            return True
+        if not isinstance(value, dict):
+            return False
+        if not value and only_type_keys:
+            return True
+        for k, v in value.items():
+            node_ok = oks.get(k)
+            if node_ok is None:
+                node = resolve(k)
+                if node is None:
+                    if exact_match:
+                        return False
+                    continue
+                node_ok = node.ok
+            if not node_ok(v):
+                return False
+        if not value.keys() >= required:
+            return False
+        for k, node, default, validated in optional:
+            if k not in value and validated is _missing and not node.ok(default):
+                return False
+        return True
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(_compiled(schema, copy=copy) if exact_match else run, value)
+        if not isinstance(value, dict):
+            _error(errors, path, 'type', schema, value, '{} <{}> does not match schema: {} <{}>', value, type(value), schema, type(schema))
+            return value
+        if not value and only_type_keys:
+            return value
+        if type(value) is dict:
+            _value = {}
+        else:
+            _value = value.copy()
+            _value.clear()
+        for k, v in value.items():
+            node = nodes.get(k) or resolve(k)
+            path.append(k)
+            if node is not None:
+                _value[k] = node.collect(v, path, errors)
+            elif exact_match:
+                _error(errors, path, 'unknown-key', schema, value, '{} <{}> does not match schema keys: {}', k, type(k), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema]))
+            path.pop()
+        if not _value.keys() >= required:
+            for k, v in schema.items():
+                if k in required and k not in _value:
+                    path.append(k)
+                    if _is_optional(v):
+                        _error(errors, path, 'schema', v, None, ':optional schema should be [:optional, schema, default-value], not: {}', v)
+                    else:
+                        _error(errors, path, 'missing-key', schema, _value, '{} <{}> is missing required key: {} <{}>', _value, type(_value), k, type(k))
+                    path.pop()
+        for k, node, default, validated in optional:
+            if k not in _value:
+                if validated is _missing:
+                    path.append(k)
+                    validated = node.collect(default, path, errors)
+                    path.pop()
+                _value[k] = validated
+        return _value
+    return _node(run, ok, True, collect)
+
+def _apply_changes(value, changes):
+    if type(value) is dict:
+        _value = {}
+    else:
+        _value = value.copy()
+        _value.clear()
+    for k, v in value.items():
+        if changes:
+            v = changes.get(k, v)
+        if v is not _missing:
+            _value[k] = v
+    return _value
+
+def _reraise(schema, value, locate=None):
+    # context is only added to an error as it propagates, so the success path pays nothing for it.
+    # the key or index of the failing item is found again by locate, only once validation has failed.
+    error = sys.exc_info()[1]
+    key = _missing
+    if locate is not None:
+        probing = _local.probing
+        active, probing.active = probing.active, True
+        try:
+            key = locate(value)
+        except Exception:
+            pass
+        finally:
+            probing.active = active
+    if isinstance(error, ValidationError):
+        error._context(schema, value, key)
+        raise
+    _error = ValidationError('error', schema, value, error.args[0] if error.args else '')
+    _error._context(schema, value, key)
+    raise _error.with_traceback(error.__traceback__) from None
+
+def _short(value):
+    text = str(value) if _small(value, ValidationError.dump_size) else _repr.repr(value)
+    return text if len(text) <= ValidationError.dump_size else text[:ValidationError.dump_size] + ' ...'
+
+def _dump(value):
+    text = pprint.pformat(value, width=120) if _small(value, ValidationError.dump_size) else _repr.repr(value)
+    return text if len(text) <= ValidationError.dump_size else text[:ValidationError.dump_size] + ' ...'
+
+def _small(value, size):
+    # a walk bounded by size, so deciding how to dump a large value costs little
+    stack = [iter([value])]
+    while stack:
+        for x in stack[-1]:
+            size -= len(x) if isinstance(x, (str, bytes)) else 4
+            if size < 0:
+                return False
+            if isinstance(x, dict):
+                stack.append(itertools.chain.from_iterable(x.items()))
+                break
+            elif isinstance(x, (list, tuple, set, frozenset)):
+                stack.append(iter(x))
+                break
+        else:
+            stack.pop()
+    return True
+
+def _format_tracebacks(errors):
+    # formatted only once every alternative has failed
+    return [''.join(traceback.format_exception(type(e), e, e.__traceback__)) for e in errors]
+
+def _is_optional(schema):
+    return isinstance(schema, (list, tuple)) and schema and schema[0] == ':optional'
+
+def _default(node, default):
+    # immutable defaults can be validated once and shared, others are validated on every use,
+    # as are defaults which fail, or raise, so they fail only when they are used
+    if type(default) in _immutable_types:
+        try:
+            return node(default)
+        except Exception:
+            pass
+    return _missing
+
+def _missing_keys(schema, _value):
+    for k, v in schema.items():
+        if k not in _value:
+            if _is_optional(v):
+                if len(v) != 3:
+                    raise ValidationError('schema', v, None, ':optional schema should be [:optional, schema, default-value], not: {}', v)
+                _value[k] = _validate(*v[1:])
+            elif not (isinstance(k, type) or isinstance(k, _predicate_types)):
+                error = ValidationError('missing-key', schema, _value, '{} <{}> is missing required key: {} <{}>', _value, type(_value), k, type(k))
+                error.path.append(k)
+                raise error
+
+def _compile_object(schema, futures):
+    def run(value):
+        if futures and _is_future(value):
+            return _future(run, value)
+        return value
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+        return True
+    def collect(value, path, errors):
+        return run(value)
+    return _node(run, ok, False, collect)
+
+def _compile_seq(schema, copy, futures):
+    is_seq = _starts_with_keyword(schema)
+    if schema and schema[0] in _schema_commands:
+        if schema[0] == ':optional':
+            check = _compile_optional(schema, copy)
+        elif schema[0] == ':or':
+            check = _compile_or(schema, copy)
+        elif schema[0] == ':and':
+            check = _compile_and(schema, copy)
+        elif schema[0] == ':fn':
+            check = _compile_fn(schema)
+        elif schema[0] == ':range':
+            check = _compile_range(schema)
+    elif isinstance(schema, list):
+        check = _compile_list(schema, copy)
+    else:
+        check = _compile_tuple(schema, copy)
+    check_ok = check.ok
+    locate = getattr(check, 'locate', None)
+    # arrays are validated like their tolist(), but returned as is when the vectorized check passes
+    vector = getattr(check, 'vector', None)
+    if vector is not None:
+        locate_array = lambda value: locate(value.tolist()) if _is_array_type(type(value)) else _missing
+    else:
+        locate_array = None
+    def run(value):
+        try:
+            if futures and _is_future(value):
+                return _future(run, value)
+            if not (is_seq or isinstance(value, (list, tuple))):
+                if vector is not None and _is_array_type(type(value)):
+                    return value if vector(value) else check(value.tolist())
+                raise ValidationError('type', schema, value, '{} <{}> is not a seq: {} <{}>', value, type(value), schema, type(schema))
+            return check(value)
+        except AssertionError:
+            _reraise(schema, value, locate if is_seq or isinstance(value, (list, tuple)) else locate_array)
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+            return True
+        if vector is not None and _is_array_type(type(value)):
+            return vector(value) or check_ok(value.tolist())
+        return (is_seq or isinstance(value, (list, tuple))) and check_ok(value)
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(run, value)
+        if not (is_seq or isinstance(value, (list, tuple))):
+            if vector is not None and _is_array_type(type(value)):
+                return value if vector(value) else check.collect(value.tolist(), path, errors)
+            _error(errors, path, 'type', schema, value, '{} <{}> is not a seq: {} <{}>', value, type(value), schema, type(schema))
+            return value
+        return check.collect(value, path, errors)
+    return _node(run, ok, check.transforms, collect)
+
+def _compile_optional(schema, copy):
+    if len(schema) == 3:
+        return _compile(schema[1], copy=copy)
+    def check(value):
+        raise ValidationError('schema', schema, value, ':optional schema should be [:optional, schema, default-value], not: {}', schema)
+    def collect(value, path, errors):
+        _error(errors, path, 'schema', schema, value, ':optional schema should be [:optional, schema, default-value], not: {}', schema)
+        return value
+    return _node(check, lambda value: False, False, collect)
+
+def _compile_or(schema, copy):
+    nodes = [_compile(x, copy=copy) for x in schema[1:]]
+    oks = [node.ok for node in nodes]
+    def check(value):
+        if not nodes:
+            raise ValidationError('schema', schema, value, 'union types cannot be empty: {}', schema)
+        # alternatives are tried by ok, so only a union which fails raises, and builds context, for
+        # every alternative. futures are patched by every alternative, so they are always run
+        if not _is_future(value):
+            i, futures = _probe(first, value)
+            if i is not None:
+                _value = value
+                try:
+                    for j in range(i, len(nodes)):
+                        if j > i:
+                            valid, futures = _probe(oks[j], _value)
+                            if not valid:
+                                continue
+                        _value = nodes[j](_value) if nodes[j].transforms or futures else _value
+                except AssertionError: # an ok which disagrees with its node
+                    pass
+                else:
+                    return _value
+        errors = []
+        for node in nodes:
+            try:
+                value = node(value)
+            except AssertionError as e:
+                errors.append(e)
+        if len(errors) == len(nodes):
+            raise ValidationError('union', schema, value, lambda: '{} <{}> did not match *any* of [{}]\n{}'.format(_short(value), type(value), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema[1:]]), '\n'.join(_format_tracebacks(errors))))
+        else:
+            return value
+    def first(value):
+        for i, node_ok in enumerate(oks):
+            if node_ok(value):
+                return i
+    def ok(value):
+        # alternatives after the first success see its output, so only the first success can decide validity
+        return first(value) is not None
+    def collect(value, path, errors):
+        if not nodes:
+            _error(errors, path, 'schema', schema, value, 'union types cannot be empty: {}', schema)
+        elif _probe(ok, value)[0]:
+            return check(value) # cannot fail once an alternative is valid
+        else:
+            alternatives = [[] for _ in nodes]
+            for node, _errors in zip(nodes, alternatives):
+                node.collect(value, path, _errors)
+            _error(errors, path, 'union', schema, value, lambda: '{} <{}> did not match *any* of [{}]\n{}'.format(
+                _short(value), type(value), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema[1:]]), '\n'.join(str(e) for _errors in alternatives for e in _errors)))
+        return value
+    return _node(check, ok, any(node.transforms for node in nodes), collect)
+
+def _compile_and(schema, copy):
+    nodes = [_compile(x, copy=copy) for x in schema[1:]]
+    def check(value):
+        if not nodes:
+            raise ValidationError('schema', schema, value, 'intersection types cannot be empty: {}', schema)
+        errors = []
+        for node in nodes:
+            try:
+                value = node(value)
+            except AssertionError as e:
+                errors.append(e)
+        if errors:
+            raise ValidationError('intersection', schema, value, lambda: '{} <{}> did not match *all* of [{}]\n{}'.format(_short(value), type(value), ', '.join(['{} <{}>'.format(x, type(x)) for x in schema[1:]]), '\n'.join(_format_tracebacks(errors))))
+        else:
+            return value
+    def ok(value):
+        # each intersection sees the output of the previous one, so transforming nodes must be run
+        if not nodes:
+            return False
+        for i, node in enumerate(nodes, 1):
+            if not node.ok(value):
+                return False
+            if node.transforms and i < len(nodes):
+                value = node(value)
+        return True
+    def collect(value, path, errors):
+        # like check, each schema sees the output of the last one which succeeded
+        if not nodes:
+            _error(errors, path, 'schema', schema, value, 'intersection types cannot be empty: {}', schema)
+        for node in nodes:
+            _errors = []
+            _value = node.collect(value, path, _errors)
+            if _errors:
+                errors.extend(_errors)
+            else:
+                value = _value
+        return value
+    return _node(check, ok, any(node.transforms for node in nodes), collect)
+
+def _compile_fn(schema):
+    def failure(value):
+        # the reason, message and args of the error for value, or None if it is valid
+        if not isinstance(value, types.FunctionType):
+            return 'function', '{} <{}> is not a function', value, type(value)
+        if len(schema) not in [2, 3]:
+            return 'schema', ':fn schema should be (:fn, [<args>...], {{<kwargs>: <val>, ...}}) or (:fn, [<args>...]), not: {}', schema
+        args, kwargs = schema[1:]
+        _args, _kwargs = value._schema
+        if not tuple(_args) == tuple(args):
+            return 'function', 'pos args {} did not match {}', _args, args
+        if not _kwargs == kwargs:
+            return 'function', 'kwargs {} did not match {}', _kwargs, kwargs
+    def check(value):
+        _failure = failure(value)
+        if _failure is not None:
+            raise ValidationError(_failure[0], schema, value, *_failure[1:])
+        return value
+    def ok(value):
+        return failure(value) is None
+    def collect(value, path, errors):
+        _failure = failure(value)
+        if _failure is not None:
+            _error(errors, path, _failure[0], schema, value, *_failure[1:])
+        return value
+    return _node(check, ok, False, collect)
+
+def _compile_range(schema):
+    if len(schema) == 3:
+        _, lo, hi = schema
+    def ok(value):
+        try:
+            return (lo is None or lo <= value) and (hi is None or value <= hi)
+        except TypeError:
+            return False
+    def check(value):
+        if len(schema) != 3:
+            raise ValidationError('schema', schema, value, ':range schema should be (:range, <min>, <max>), not: {}', schema)
+        if not ok(value):
+            raise ValidationError('range', schema, value, '{} <{}> is not in range: [{}, {}]', value, type(value), lo, hi)
+        return value
+    def collect(value, path, errors):
+        if len(schema) != 3:
+            _error(errors, path, 'schema', schema, value, ':range schema should be (:range, <min>, <max>), not: {}', schema)
+        elif not ok(value):
+            _error(errors, path, 'range', schema, value, '{} <{}> is not in range: [{}, {}]', value, type(value), lo, hi)
+        return value
+    return _node(check, ok if len(schema) == 3 else lambda value: False, False, collect)
+
+def _compile_list(schema, copy):
+    if len(schema) == 1:
+        node = _compile(schema[0], copy=copy)
+        node_ok = node.ok
+        kernel = _scalar_kernel(schema[0])
+        columns = _columns(schema[0], copy, node)
+        if kernel is not None:
+            # the items which pass the kernel are unchanged by node, so a failing list is validated again by node
+            if copy:
+                def check(value):
+                    return list(value) if kernel(value) else [node(v) for v in value]
+            else:
+                def check(value):
+                    return value if kernel(value) else _seq_in_place(value, itertools.repeat(node), node.transforms)
+            def ok(value):
+                return kernel(value) or all(map(node_ok, value))
+        elif columns is not None:
+            # a failing list is validated again row by row, for the error
+            if copy:
+                def check(value):
+                    _value = columns(value)
+                    return [node(v) for v in value] if _value is _missing else _value
+            else:
+                def check(value):
+                    _value = columns(value)
+                    return _seq_in_place(value, itertools.repeat(node), node.transforms) if _value is _missing else _value
+            columns_ok = columns.ok
+            def ok(value):
+                _ok = columns_ok(value)
+                return all(map(node_ok, value)) if _ok is _missing else _ok
+        else:
+            if copy:
+                def check(value):
+                    return [node(v) for v in value]
+            else:
+                def check(value):
+                    return _seq_in_place(value, itertools.repeat(node), node.transforms)
+            def ok(value):
+                return all(map(node_ok, value))
+        def locate(value):
+            for i, v in enumerate(value):
+                if not _is_future(v) and not node_ok(v):
+                    return i
+            return _missing
+        check.locate = locate
+        check.vector = _vector(schema[0])
+        node_collect = node.collect
+        def collect(value, path, errors):
+            if kernel is not None and kernel(value):
+                return list(value)
+            if copy and columns is not None:
+                try:
+                    _value = columns(value)
+                except Exception: # collected again row by row
+                    _value = _missing
+                if _value is not _missing:
+                    return _value
+            _value = []
+            for i, v in enumerate(value):
+                path.append(i)
+                _value.append(node_collect(v, path, errors))
+                path.pop()
+            return _value
+    else:
+        def check(value):
+            raise ValidationError('schema', schema, value, 'list schemas represent homogenous seqs and must contain a single schema: {}', schema)
+        ok = lambda value: False
+        def collect(value, path, errors):
+            _error(errors, path, 'schema', schema, value, 'list schemas represent homogenous seqs and must contain a single schema: {}', schema)
             return value
-        elif isinstance(schema, (types.FunctionType, type(callable))):
-            assert schema(value), '{} <{}> failed predicate schema: {} <{}>'.format(value, type(value), util.func.source(schema), type(schema))
+    return _node(check, ok, True, collect)
+
+def _compile_tuple(schema, copy):
+    nodes = [_compile(x, copy=copy) for x in schema]
+    oks = [node.ok for node in nodes]
+    transforms = any(node.transforms for node in nodes)
+    def check(value):
+        if len(schema) != len(value):
+            raise ValidationError('length', schema, value, '{} <{}> mismatched length of schema: {} <{}>', value, type(value), schema, type(schema))
+        if copy:
+            return [node(v) for node, v in zip(nodes, value)]
+        else:
+            return _seq_in_place(value, nodes, transforms)
+    def ok(value):
+        return len(schema) == len(value) and all(node_ok(v) for node_ok, v in zip(oks, value))
+    def locate(value):
+        if len(schema) == len(value):
+            for i, (node_ok, v) in enumerate(zip(oks, value)):
+                if not _is_future(v) and not node_ok(v):
+                    return i
+        return _missing
+    check.locate = locate
+    def collect(value, path, errors):
+        if len(schema) != len(value):
+            _error(errors, path, 'length', schema, value, '{} <{}> mismatched length of schema: {} <{}>', value, type(value), schema, type(schema))
             return value
+        _value = []
+        for i, (node, v) in enumerate(zip(nodes, value)):
+            path.append(i)
+            _value.append(node.collect(v, path, errors))
+            path.pop()
+        return _value
+    return _node(check, ok, True, collect)
+
+def _scalar_kernel(schema):
+    # a check of every item of a list in one pass, for lists of types and literals. it is only
+    # true if every item is valid, and left unchanged by the node for schema. so subclasses
+    # are checked once per type, not per item, and anything unusual, like futures, is false.
+    alternatives = schema[1:] if isinstance(schema, tuple) and len(schema) > 1 and schema[0] == ':or' else [schema]
+    if all(x is None or isinstance(x, type) and x is not object and not util.misc.is_future(x) for x in alternatives):
+        classes = tuple(type(None) if x is None else x for x in alternatives)
+        exact = frozenset(t for t in _plain_types | set(classes) if issubclass(t, classes))
+        def kernel(value):
+            types = set(map(type, value))
+            return types <= exact or all(t in exact or issubclass(t, classes) and not util.misc.is_future(t) for t in types)
+        return kernel
+    elif all(type(x) in (str, int, bool, type(None)) for x in alternatives):
+        literals = frozenset(alternatives)
+        def kernel(value):
+            try:
+                return literals.issuperset(value)
+            except TypeError: # unhashable
+                return False
+        return kernel
+
+def _columns(schema, copy, node=None):
+    # validates a list of records a column at a time, for list schemas of dicts with literal keys.
+    # the keys of the rows are checked once per distinct set of keys, then each column by its
+    # scalar kernel, or else by its node, and rows are rebuilt as the row by row path would.
+    # a failure raises the error of the first failing row, as row by row validation would.
+    # anything else, like a dict subclass, or rows holding futures, which are not patched by
+    # the columns, is _missing, and is validated again row by row.
+    if not (isinstance(schema, dict) and schema and _record_keys(schema)):
+        return None
+    if node is None:
+        node = _compile(schema, copy=copy)
+    row_node = node
+    columns = []
+    for k, v in schema.items():
+        columns.append((k, operator.itemgetter(k), _scalar_kernel(v[1] if _is_optional(v) else v), row_node.nodes[k]))
+    keys = frozenset(schema)
+    required = frozenset(k for k, v in schema.items() if not _is_optional(v))
+    optional = [(k, node, v[2], _default(node, v[2])) for (k, _, _, node), v in zip(columns, schema.values()) if _is_optional(v)]
+    invalid = set()
+    for k, node, default, validated in optional:
+        if validated is _missing:
+            try:
+                if not node.ok(default):
+                    invalid.add(k)
+            except Exception: # raised again, by the row, if the default is used
+                invalid.add(k)
+    columns.sort(key=lambda x: x[2] is None) # kernels first, so a failure is usually found before the slower columns
+    def shape(rows):
+        # the keys of each row, None if every row has the same keys, and for each distinct set of
+        # keys, whether it has no unknown keys and the optional keys it is missing. None if a row
+        # is missing a required key, and _missing for short lists, which are faster row by row,
+        # and rows missing a key whose default is invalid, which fail as soon as they are rebuilt
+        if len(rows) < 16 or set(map(type, rows)) != {dict}:
+            return _missing
+        first = rows[0].keys()
+        if all(map(first.__eq__, map(dict.keys, rows))):
+            shapes, distinct = None, [frozenset(first)]
         else:
-            if isinstance(value, bytes):
-                value = value.decode('utf-8')
-            assert value == schema, '{} <{}> does not equal: {} <{}>'.format(value, type(value), schema, type(schema))
+            shapes = list(map(frozenset, rows))
+            distinct = set(shapes)
+        plans = {}
+        for keys_ in distinct:
+            if not keys_ >= required:
+                return None
+            if invalid and not keys_ >= invalid:
+                return _missing
+            plans[keys_] = keys_ <= keys, [x for x in optional if x[0] not in keys_]
+        return shapes, plans
+    def column(rows, n, k, get, shapes, plans):
+        # the items of a column in the first n rows, and the indices of the rows which have it, None if every row does
+        if all(k in keys_ for keys_ in plans):
+            return None, list(map(get, rows if n == len(rows) else rows[:n]))
+        index = [i for i, keys_ in zip(range(n), shapes) if k in keys_]
+        return index, [rows[i][k] for i in index]
+    def validate_columns(rows, shapes, plans):
+        # the validated rows, or the index of the first row which failed
+        failed = len(rows)
+        changes = []
+        for k, get, kernel, node in columns:
+            if not any(k in keys_ for keys_ in plans):
+                continue
+            index, items = column(rows, failed, k, get, shapes, plans)
+            if kernel is not None and kernel(items):
+                continue
+            results = []
+            try:
+                results.extend(map(node, items))
+            except Exception: # any exception, so the first failing row decides which is raised
+                failed = len(results) if index is None else index[len(results)]
+                continue
+            if node.transforms and any(map(operator.is_not, results, items)):
+                changes.append((index, k, results))
+        if failed < len(rows):
+            return failed
+        if not changes and all(clean and not defaults for clean, defaults in plans.values()):
+            return list(map(dict, rows)) if copy else rows
+        _rows = []
+        for row, (clean, defaults) in zip(rows, itertools.repeat(*plans.values()) if shapes is None else map(plans.__getitem__, shapes)):
+            if not clean:
+                row = {k: v for k, v in row.items() if k in keys}
+            elif copy or defaults:
+                row = dict(row)
+            for k, node, default, validated in defaults:
+                row[k] = node(default) if validated is _missing else validated
+            _rows.append(row)
+        for index, k, results in changes:
+            for i, result in zip(range(len(rows)) if index is None else index, results):
+                if _rows[i] is rows[i]:
+                    if result is rows[i][k]:
+                        continue
+                    _rows[i] = dict(rows[i])
+                _rows[i][k] = result
+        return rows if all(map(operator.is_, _rows, rows)) else _rows
+    def run(rows):
+        shaped = shape(rows)
+        if shaped is None or shaped is _missing:
+            return _missing
+        # futures are left unpatched by the columns, and noted, so they are only patched row by row
+        _rows, futures = _probe(lambda rows: validate_columns(rows, *shaped), rows)
+        if futures:
+            return _missing
+        if type(_rows) is int:
+            row_node(rows[_rows]) # raises
+            return _missing
+        return _rows
+    def ok(rows):
+        # true, or _missing, so the rows are checked again row by row, and the first failing row
+        # decides whether ok is false or raises
+        shaped = shape(rows)
+        if shaped is None or shaped is _missing:
+            return _missing
+        shapes, plans = shaped
+        try:
+            for k, get, kernel, node in columns:
+                if any(k in keys_ for keys_ in plans):
+                    _, items = column(rows, len(rows), k, get, shapes, plans)
+                    if not (kernel is not None and kernel(items) or all(map(node.ok, items))):
+                        return _missing
+        except Exception:
+            return _missing
+        return True
+    run.ok = ok
+    return run
+
+# the kind of a number, as in numpy's dtype.kind, by array.array typecode or memoryview format
+_typecode_kinds = {'?': 'b', 'b': 'i', 'h': 'i', 'i': 'i', 'l': 'i', 'q': 'i', 'n': 'i',
+                   'B': 'u', 'H': 'u', 'I': 'u', 'L': 'u', 'Q': 'u', 'N': 'u', 'e': 'f', 'f': 'f', 'd': 'f'}
+
+# the kinds of number whose tolist() items are instances of each type
+_type_kinds = {int: 'biu', float: 'f', bool: 'b', complex: 'c'}
+
+def _is_array_type(tp):
+    # numpy is optional, and if it was never imported, there are no numpy arrays
+    numpy = sys.modules.get('numpy')
+    return issubclass(tp, (array.array, memoryview)) or numpy is not None and issubclass(tp, numpy.ndarray)
+
+def _vector_parts(schema):
+    # the kinds of number allowed by schema, and its ranges, or None if it cannot be vectorized
+    if isinstance(schema, type) and schema in _type_kinds:
+        return _type_kinds[schema], []
+    elif isinstance(schema, tuple) and len(schema) == 3 and schema[0] == ':range' and all(x is None or type(x) in (int, float) for x in schema[1:]):
+        return 'biuf', [schema[1:]]
+    elif isinstance(schema, tuple) and len(schema) > 1 and schema[0] == ':and':
+        parts = [_vector_parts(x) for x in schema[1:]]
+        if all(parts):
+            kinds = [k for k in 'biufc' if all(k in _kinds for _kinds, _ in parts)]
+            return ''.join(kinds), [r for _, ranges in parts for r in ranges]
+
+def _vector(schema):
+    # a check of a one dimensional array of numbers, by its dtype or typecode, then its min and max
+    parts = _vector_parts(schema)
+    if not parts:
+        return None
+    kinds, ranges = parts
+    def vector(value):
+        if isinstance(value, array.array):
+            kind = _typecode_kinds.get(value.typecode)
+            numbers = value
+        elif isinstance(value, memoryview):
+            kind = value.ndim == 1 and _typecode_kinds.get(value.format.lstrip('@=<>!'))
+            numbers = value
+        else:
+            kind = value.ndim == 1 and value.dtype.kind
+            numbers = None
+        if not kind or kind not in kinds:
+            return False
+        if not ranges or not len(value):
+            return True
+        if numbers is None:
+            lo, hi = value.min(), value.max() # nan, so out of range, if any value is nan
+        elif kind == 'f' and any(map(math.isnan, numbers)):
+            return False
+        else:
+            lo, hi = min(numbers), max(numbers)
+        return all((_lo is None or _lo <= lo) and (_hi is None or hi <= _hi) for _lo, _hi in ranges)
+    return vector
+
+def _seq_in_place(value, nodes, transforms):
+    # the value is only copied, into a list, from the first item which changed
+    if not transforms:
+        for node, v in zip(nodes, value):
+            node(v)
+        return value
+    _value = None
+    for i, (node, v) in enumerate(zip(nodes, value)):
+        _v = node(v)
+        if _value is not None:
+            _value.append(_v)
+        elif _v is not v:
+            _value = list(value[:i])
+            _value.append(_v)
+    return value if _value is None else _value
+
+def _compile_type(schema, futures):
+    def run(value):
+        try:
+            if futures and _is_future(value):
+                return _future(run, value)
+            if not isinstance(value, schema):
+                raise ValidationError('type', schema, value, '{} <{}> is not a: {} <{}>', value, type(value), schema, type(schema))
             return value
+        except AssertionError:
+            _reraise(schema, value)
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+            return True
+        return isinstance(value, schema)
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(run, value)
+        if not isinstance(value, schema):
+            _error(errors, path, 'type', schema, value, '{} <{}> is not a: {} <{}>', value, type(value), schema, type(schema))
+        return value
+    return _node(run, ok, False, collect)
+
+def _compile_predicate(schema, futures):
+    def run(value):
+        try:
+            if futures and _is_future(value):
+                return _future(run, value)
+            if not schema(value):
+                raise ValidationError('predicate', schema, value, lambda: '{} <{}> failed predicate schema: {} <{}>'.format(_short(value), type(value), util.func.source(schema), type(schema)))
+            return value
+        except AssertionError:
+            _reraise(schema, value)
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+            return True
+        return schema(value)
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(run, value)
+        try:
+            valid = schema(value)
+        except AssertionError as e: # raised by the predicate itself
+            _error(errors, path, 'error', schema, value, e.args[0] if e.args else '')
+        else:
+            if not valid:
+                _error(errors, path, 'predicate', schema, value, lambda: '{} <{}> failed predicate schema: {} <{}>'.format(_short(value), type(value), util.func.source(schema), type(schema)))
+        return value
+    return _node(run, ok, False, collect)
+
+def _compile_literal(schema, futures):
+    def run(value):
+        try:
+            if futures and _is_future(value):
+                return _future(run, value)
+            _value = value.decode('utf-8') if isinstance(value, bytes) else value
+            if not _value == schema:
+                raise ValidationError('equal', schema, value, '{} <{}> does not equal: {} <{}>', _value, type(_value), schema, type(schema))
+            return _value
+        except AssertionError:
+            _reraise(schema, value)
+    def ok(value):
+        if futures and _is_future(value):
+            _future(run, value)
+            return True
+        return (value.decode('utf-8') if isinstance(value, bytes) else value) == schema
+    def collect(value, path, errors):
+        if futures and _is_future(value):
+            return _future(run, value)
+        _value = value.decode('utf-8') if isinstance(value, bytes) else value
+        if not _value == schema:
+            _error(errors, path, 'equal', schema, value, '{} <{}> does not equal: {} <{}>', _value, type(_value), schema, type(schema))
+        return _value
+    return _node(run, ok, True, collect)
+
+class _Fallback(Exception):
+    pass
+
+def _generate(schema, exact_match):
+    # the generated code only decides the common case. it raises, usually _Fallback, for values
+    # which fail, futures, and anything unusual, and those values are validated again by the
+    # closures from _compile, which raise the usual errors. so the generated code never builds
+    # an error, and parts of a schema without a generated form are validated by their closure.
+    node = _compile(schema, exact_match)
+    consts = {'B': _Fallback, 'M': _missing, 'F': _is_future}
+    lines = []
+    names = itertools.count()
+    def const(value):
+        name = 'c{}'.format(next(names))
+        consts[name] = value
+        return name
+    def var():
+        return 'x{}'.format(next(names))
+    def emit(schema, x, depth, loops, exact_match=False):
+        # appends the lines validating the variable x, and returns the variable holding its result
+        def line(text, *args):
+            lines.append('    ' * depth + text.format(*args))
+        check = _check_expression(schema, x, const)
+        if depth > 80 or loops > 15: # the limits of python's parser
+            pass
+        elif check is not None:
+            if _checks_futures(schema):
+                line('if F({}):', x)
+                line('    raise B')
+            if check != 'True':
+                line('if not ({}):', check)
+                line('    raise B')
+            return x
+        elif isinstance(schema, (str, bytes)):
+            y = var()
+            line('{0} = {1}.decode("utf-8") if isinstance({1}, bytes) else {1}', y, x)
+            line('if not {} == {}:', y, const(schema))
+            line('    raise B')
+            return y
+        elif isinstance(schema, dict) and _record_keys(schema):
+            y, r, e = var(), var(), var()
+            line('if not isinstance({}, dict):', x)
+            line('    raise B')
+            line('{} = {{}}', r)
+            for k, v in schema.items():
+                key = const(k)
+                if _is_optional(v): # usually missing, which costs one lookup
+                    line('if {} in {}:', key, x)
+                    line('    {} = {}[{}]', e, x, key)
+                    line('    {}[{}] = {}', r, key, emit(v[1], e, depth + 1, loops))
+                else:
+                    line('{} = {}.get({}, M)', e, x, key)
+                    line('if {} is M:', e)
+                    line('    raise B')
+                    line('{}[{}] = {}', r, key, emit(v, e, depth, loops))
+            if exact_match:
+                line('if len({}) != len({}):', r, x)
+                line('    raise B')
+            # like the closures, keys are in the order of the value, then missing optional keys
+            line('if type({}) is dict:', x)
+            line('    {0} = {{k: {1}[k] for k in {2}}} if len({1}) == len({2}) else {{k: {1}[k] for k in {2} if k in {1}}}', y, r, x)
+            line('else:')
+            line('    {} = {}.copy()', y, x)
+            line('    {}.clear()', y)
+            line('    {}.update((k, {}[k]) for k in {} if k in {})', y, r, x, r)
+            for k, v in schema.items():
+                if _is_optional(v):
+                    _node = _compile(v[1])
+                    validated = _default(_node, v[2])
+                    key = const(k)
+                    line('if {} not in {}:', key, y)
+                    if validated is _missing:
+                        line('    {}[{}] = {}({})', y, key, const(_node), const(v[2]))
+                    else:
+                        line('    {}[{}] = {}', y, key, const(validated))
+            return y
+        elif isinstance(schema, dict) and _map_key(schema):
+            [(k, v)] = schema.items()
+            y, e, z = var(), var(), var()
+            line('if not isinstance({}, dict):', x)
+            line('    raise B')
+            line('if not {}:', x)
+            line('    {} = {}', y, x)
+            line('else:')
+            line('    {} = {{}} if type({}) is dict else {}.copy()', y, x, x)
+            line('    {}.clear()', y)
+            line('    for {}, {} in {}.items():', z, e, x)
+            line('        if type({0}) is {1} or {0} is {1}:', z, const(k))
+            line('            {}[{}] = {}', y, z, emit(v, e, depth + 3, loops + 1))
+            if exact_match:
+                line('        else:')
+                line('            raise B')
+            return y
+        elif isinstance(schema, list) and len(schema) == 1:
+            if not _starts_with_keyword(schema):
+                line('if not isinstance({}, (list, tuple)):', x)
+                line('    raise B')
+            y, e = var(), var()
+            kernel = _scalar_kernel(schema[0])
+            if kernel is not None:
+                line('if not {}({}):', const(kernel), x)
+                line('    raise B')
+                line('{} = list({})', y, x)
+                return y
+            columns = _columns(schema[0], True)
+            if columns is not None: # rows are validated one by one only if the columns could not be
+                line('{} = {}({})', y, const(columns), x)
+                line('if {} is M:', y)
+                depth += 1
+            start = len(lines)
+            line('for {} in {}:', e, x)
+            result = emit(schema[0], e, depth + 1, loops + 1)
+            if result == e:
+                if len(lines) == start + 1:
+                    lines.pop() # nothing to check
+                line('{} = list({})', y, x)
+            else:
+                lines.insert(start, '    ' * depth + '{} = []'.format(y))
+                line('    {}.append({})', y, result)
+            return y
+        elif isinstance(schema, set) and len(schema) == 1:
+            line('if not isinstance({}, set):', x)
+            line('    raise B')
+            y, e = var(), var()
+            start = len(lines)
+            line('for {} in {}:', e, x)
+            result = emit(list(schema)[0], e, depth + 1, loops + 1)
+            if result == e:
+                if len(lines) == start + 1:
+                    lines.pop()
+                line('{} = set({})', y, x)
+            else:
+                lines.insert(start, '    ' * depth + '{} = set()'.format(y))
+                line('    {}.add({})', y, result)
+            return y
+        elif isinstance(schema, tuple) and schema and schema[0] not in _schema_commands:
+            if not _starts_with_keyword(schema):
+                line('if not isinstance({}, (list, tuple)):', x)
+                line('    raise B')
+            line('if len({}) != {}:', x, len(schema))
+            line('    raise B')
+            elements = [var() for _ in schema]
+            line('[{}] = {}', ''.join(e + ', ' for e in elements), x)
+            y = var()
+            results = [emit(sc, e, depth, loops) for sc, e in zip(schema, elements)]
+            line('{} = [{}]', y, ', '.join(results))
+            return y
+        elif isinstance(schema, tuple) and len(schema) == 3 and schema[0] == ':optional':
+            return emit(schema[1], x, depth, loops)
+        y = var()
+        line('{} = {}({})', y, const(_compile(schema, exact_match)), x)
+        return y
+    result = emit(schema, 'value', 2, 0, exact_match)
+    source = 'def validate(value):\n{}\n    return {}\n'.format('\n'.join(line[4:] for line in lines), result)
+    # constants are bound as locals of a factory, which is faster than globals
+    factory = 'def factory(consts):\n{}\n{}    return validate\n'.format(
+        ''.join('    {0} = consts[{0!r}]\n'.format(name) for name in consts), ''.join('    ' + line + '\n' for line in source.splitlines()))
+    digest = hashlib.sha1(factory.encode('utf-8')).hexdigest()
+    code = _codes.get(digest)
+    if code is None:
+        code = builtins.compile(factory, '<schema>', 'exec')
+    namespace = {}
+    exec(code, namespace)
+    generated = namespace['factory'](consts)
+    def run(value):
+        try:
+            return generated(value)
+        except Exception:
+            pass
+        return node(value) # outside the except, so errors are not chained to the fallback
+    run.source = source
+    run._code = digest, code
+    return _node(run, node.ok, node.transforms, node.collect)
+
+def _check_expression(schema, x, const):
+    # a boolean expression for the schemas which only check their value, and return it unchanged
+    if schema is object:
+        return 'True'
+    elif isinstance(schema, type):
+        return 'isinstance({}, {})'.format(x, const(schema))
+    elif isinstance(schema, _predicate_types):
+        return '{}({})'.format(const(schema), x)
+    elif type(schema) in _immutable_types and not isinstance(schema, (str, bytes)):
+        return '{} == {}'.format(x, const(schema))
+    elif isinstance(schema, tuple) and len(schema) == 3 and schema[0] == ':range':
+        bounds = ['{} <= {}'.format(const(schema[1]), x)] if schema[1] is not None else []
+        bounds += ['{} <= {}'.format(x, const(schema[2]))] if schema[2] is not None else []
+        return ' and '.join(bounds) or 'True'
+    elif isinstance(schema, tuple) and len(schema) > 1 and schema[0] in [':or', ':and']:
+        checks = [_check_expression(sc, x, const) for sc in schema[1:]]
+        if all(checks):
+            if schema[0] == ':and':
+                return ' and '.join('({})'.format(c) for c in checks)
+            elif any(isinstance(sc, _predicate_types) for sc in schema[1:]):
+                return 'any([{}])'.format(', '.join(checks)) # like the closures, every alternative is tried
+            else:
+                return ' or '.join('({})'.format(c) for c in checks)
+
+def _checks_futures(schema):
+    # whether a future could pass the check expression, and so must be checked for first
+    if isinstance(schema, tuple):
+        return any(_checks_futures(sc) for sc in schema[1:])
+    elif isinstance(schema, type):
+        return schema not in _plain_types and not util.misc.is_future(schema)
+    else:
+        return isinstance(schema, _predicate_types)
+
+def _record_keys(schema):
+    # literal keys, whose optional values are well formed
+    return all(not isinstance(k, (type,) + _predicate_types) and (not _is_optional(v) or len(v) == 3) for k, v in schema.items())
+
+def _map_key(schema):
+    # a single type key, with no default
+    if len(schema) == 1:
+        [(k, v)] = schema.items()
+        return type(k) is type and k is not object and not _is_optional(v)
 
 def _formdent(x):
     return util.strings.indent(pprint.pformat(x, width=120), 2)
@@ -253,42 +2516,78 @@ def _updater(schema, value):
     return lambda x: _prettify(x + _helpful_message(schema, value))
 
 def _helpful_message(schema, value):
-    for fn in [x for x in util.iter.flatten(schema) if isinstance(x, (types.FunctionType, types.LambdaType))]:
-        try:
-            filename, linenum = fn.__code__.co_filename, fn.__code__.co_firstlineno
-            with open(filename) as f:
-                lines = f.read().splitlines()
-            start = end = None
-            for i in reversed(range(linenum)):
-                if not lines[i].strip() or 'def ' in lines[i] or 'class ' in lines[i]:
-                    break
-                elif ' = ' in lines[i]:
-                    start = i
-                    break
-            if start is None:
-                filename, linenum = fn.__code__.co_filename, fn.__code__.co_firstlineno
-                schema = 'function:{filename}:{linenum}'.format(**locals())
-            else:
-                if any(x in lines[start] for x in ['{', '(', '[']):
-                    for i in range(linenum, len(lines) + 1):
-                        text = '\n'.join(lines[start:i])
-                        if all(text.count(x) == text.count(y) for x, y in [('{', '}'), ('[', ']'), ('(', ')')]):
-                            end = i
-                            break
-                if end is not None:
-                    schema = '\n'.join(lines[start:end])
-                    size = len(lines[start]) - len(lines[start].lstrip())
-                    schema = util.strings.unindent(schema, size)
-            break
-        except:
-            continue
-    else:
-        schema = pprint.pformat(schema, width=120)
     return '\n\nobj:\n{}\nschema:\n{}'.format(
-        util.strings.indent(pprint.pformat(value, width=120), 2),
-        util.strings.indent(schema, 2),
+        util.strings.indent(_dump(value), 2),
+        util.strings.indent(_schema_source(schema), 2),
     )
 
+def _schema_source(schema):
+    # the functions in a schema are found once per schema, and the source of
+    # each function is read once per code object until its file changes.
+    with _sources_lock:
+        entry = _schema_sources.get(id(schema))
+        if entry is not None and entry[0] is schema:
+            _schema_sources.move_to_end(id(schema))
+    if entry is None or entry[0] is not schema:
+        fns = [x for x in util.iter.flatten(schema) if isinstance(x, (types.FunctionType, types.LambdaType))]
+        entry = [schema, fns, None]
+        with _sources_lock:
+            _schema_sources[id(schema)] = entry
+            while len(_schema_sources) > _cache_size:
+                _schema_sources.popitem(last=False)
+    for fn in entry[1]:
+        text = _function_source(fn.__code__)
+        if text is _missing:
+            return schema
+        elif text is not None:
+            return text
+    if entry[2] is None:
+        entry[2] = pprint.pformat(schema, width=120)
+    return entry[2]
+
+def _function_source(code):
+    filename, linenum = code.co_filename, code.co_firstlineno
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError:
+        return None
+    with _sources_lock:
+        entry = _function_sources.get(code)
+        if entry is not None and entry[0] == mtime:
+            _function_sources.move_to_end(code)
+            return entry[1]
+    try:
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        start = end = None
+        for i in reversed(range(linenum)):
+            if not lines[i].strip() or 'def ' in lines[i] or 'class ' in lines[i]:
+                break
+            elif ' = ' in lines[i]:
+                start = i
+                break
+        if start is None:
+            text = 'function:{filename}:{linenum}'.format(**locals())
+        else:
+            text = _missing # the schema itself
+            if any(x in lines[start] for x in ['{', '(', '[']):
+                for i in range(linenum, len(lines) + 1):
+                    chunk = '\n'.join(lines[start:i])
+                    if all(chunk.count(x) == chunk.count(y) for x, y in [('{', '}'), ('[', ']'), ('(', ')')]):
+                        end = i
+                        break
+            if end is not None:
+                text = '\n'.join(lines[start:end])
+                size = len(lines[start]) - len(lines[start].lstrip())
+                text = util.strings.unindent(text, size)
+    except:
+        text = None
+    with _sources_lock:
+        _function_sources[code] = mtime, text
+        while len(_function_sources) > _cache_size:
+            _function_sources.popitem(last=False)
+    return text
+
 def _starts_with_keyword(x):
     if x and isinstance(x[0], str) and x[0].startswith(':'):
         return True
@@ -298,13 +2597,21 @@ def _starts_with_keyword(x):
 def _prettify(x):
     return re.sub(r"\<\w+ \'([\w\.]+)\'\>", r'\1', str(x))
 
+_check_options = ['offload', 'yields_every', 'yields_chunk']
+
 def _get_schemas(fn, args, kwargs):
+    # options are only read from the kwargs of check, so they never collide with parameter names
+    options = {k: kwargs[k] for k in _check_options if k in kwargs}
+    kwargs = {k: v for k, v in kwargs.items() if k not in options}
     arg_schemas, kwarg_schemas, return_schema = _read_annotations(fn, args, kwargs)
     schemas = {'yields': kwarg_schemas.pop('yields', object),
                'sends': kwarg_schemas.pop('sends', object),
                'returns': kwarg_schemas.pop('returns', return_schema),
                'args': kwarg_schemas.pop('args', None),
                'kwargs': kwarg_schemas.pop('kwargs', None),
+               'offload': options.get('offload'),
+               'yields_every': options.get('yields_every'),
+               'yields_chunk': options.get('yields_chunk'),
                'arg': arg_schemas,
                'kwarg': kwarg_schemas}
     return schemas
@@ -347,84 +2654,442 @@ def _check_args(args, kwargs, name, schemas):
         _args = []
         for i, (schema, arg) in enumerate(zip(schemas['arg'], args)):
             with util.exceptions.update('pos arg num:\n  {}'.format(i), AssertionError):
-                _args.append(validate(schema, arg))
+                _args.append(_validate(schema, arg))
         if schemas['args'] and args[len(schemas['arg']):]:
-            _args += validate(schemas['args'], args[len(schemas['arg']):])
+            _args += _validate(schemas['args'], args[len(schemas['arg']):])
         _kwargs = {}
         for k, v in kwargs.items():
             if k in schemas['kwarg']:
                 with util.exceptions.update('keyword arg:\n  {}'.format(k), AssertionError):
-                    _kwargs[k] = validate(schemas['kwarg'][k], v)
+                    _kwargs[k] = _validate(schemas['kwarg'][k], v)
             elif schemas['kwargs']:
                 with util.exceptions.update('keyword args schema failed.', AssertionError):
-                    _kwargs[k] = validate(schemas['kwargs'], {k: v})[k]
+                    _kwargs[k] = _validate(schemas['kwargs'], {k: v})[k]
             else:
                 raise AssertionError('cannot check {} for unknown key: {}={}'.format(name, k, v))
         return _args, _kwargs
 
-def _fn_check(decoratee, name, schemas):
+def _args_plan(decoratee, name, schemas, message):
+    # built once at decoration time, so a call only pays for the checks themselves. object schemas
+    # are skipped, and only a first parameter without an annotation or default can be self. on
+    # failure, the call is checked again by _check_args for its error messages.
+    method = _method_like(decoratee)
+    code = decoratee.__code__
+    fn_name = decoratee.__name__
+    n = len(schemas['arg'])
+    positional = [(i, _compiled(x)) for i, x in enumerate(schemas['arg']) if x is not object]
+    star = _compiled(schemas['args']) if schemas['args'] else None
+    keywords = {k: None if v is object else _compiled(v) for k, v in schemas['kwarg'].items()}
+    rest = _compiled(schemas['kwargs']) if schemas['kwargs'] else None
+    def check_args(args, kwargs):
+        try:
+            if method and args and code is getattr(getattr(args[0], fn_name, None), '__orig_code__', None):
+                first, _args = args[:1], args[1:]
+            else:
+                first, _args = (), args
+            if len(_args) != n and star is None:
+                raise AssertionError
+            if positional or star is not None:
+                _args = list(_args[:n]) if star is not None else list(_args)
+                for i, node in positional:
+                    if i < len(_args):
+                        _args[i] = node(_args[i])
+                if star is not None and args[len(first) + n:]:
+                    _args += star(args[len(first) + n:])
+            _kwargs = kwargs
+            if kwargs:
+                _kwargs = {}
+                for k, v in kwargs.items():
+                    node = keywords.get(k, _missing)
+                    if node is None:
+                        _kwargs[k] = v
+                    elif node is not _missing:
+                        _kwargs[k] = node(v)
+                    elif rest is not None:
+                        _kwargs[k] = rest({k: v})[k]
+                    else:
+                        raise AssertionError
+            return (first + tuple(_args) if first else _args), _kwargs
+        except AssertionError as e:
+            error = e
+        with util.exceptions.update(message.format(name), AssertionError, when=lambda x: 'failed for ' not in x):
+            _check_call(decoratee, args, kwargs, name, schemas)
+            raise error
+    return check_args
+
+def _method_like(fn):
+    params = list(inspect.signature(fn).parameters.values())
+    return bool(params) and params[0].kind is params[0].POSITIONAL_OR_KEYWORD and params[0].annotation is inspect._empty and params[0].default is inspect._empty
+
+def _check_call(decoratee, args, kwargs, name, schemas):
+    if args and decoratee.__code__ is getattr(getattr(args[0], decoratee.__name__, None), '__orig_code__', None):
+        a, kwargs = _check_args(args[1:], kwargs, name, schemas)
+        return [args[0]] + a, kwargs
+    else:
+        return _check_args(args, kwargs, name, schemas)
+
+def _defaults_plan(decoratee, schemas):
+    # fills in :optional defaults for calls which are not sampled
+    method = _method_like(decoratee)
+    code = decoratee.__code__
+    fn_name = decoratee.__name__
+    n = len(schemas['arg'])
+    positional = [(i, fn) for i, fn in enumerate(map(_defaults, schemas['arg'])) if fn]
+    star = _defaults(schemas['args']) if schemas['args'] else None
+    keywords = {k: _defaults(v) for k, v in schemas['kwarg'].items()}
+    rest = _defaults(schemas['kwargs']) if schemas['kwargs'] else None
+    if not positional and not star and not any(keywords.values()) and not rest:
+        return None
+    def fill_args(args, kwargs):
+        offset = 1 if method and args and code is getattr(getattr(args[0], fn_name, None), '__orig_code__', None) else 0
+        if positional or star:
+            args = list(args)
+            for i, fn in positional:
+                if i + offset < len(args):
+                    args[i + offset] = fn(args[i + offset])
+            if star and args[offset + n:]:
+                args[offset + n:] = star(args[offset + n:])
+        if kwargs:
+            _kwargs = {}
+            for k, v in kwargs.items():
+                fn = keywords[k] if k in keywords else None
+                if fn:
+                    _kwargs[k] = fn(v)
+                elif rest and k not in keywords:
+                    _kwargs[k] = rest({k: v}).get(k, v)
+                else:
+                    _kwargs[k] = v
+            kwargs = _kwargs
+        return args, kwargs
+    return fill_args
+
+def _call_unsampled(decoratee, fill_args, fill_returns, args, kwargs):
+    if fill_args:
+        args, kwargs = fill_args(args, kwargs)
+    value = decoratee(*args, **kwargs)
+    return fill_returns(value) if fill_returns else value
+
+def _arg_schemas(schemas):
+    return schemas['arg'] + [x for x in [schemas['args'], schemas['kwargs']] if x is not None] + list(schemas['kwarg'].values())
+
+def _returns_node(schema):
+    return None if schema is object else _compiled(schema)
+
+def _fn_check(decoratee, name, schemas, checking, profile=False):
+    check_args = _args_plan(decoratee, name, schemas, 'schema.check failed for args to function:\n  {}')
+    returns = _returns_node(schemas['returns'])
+    if profile:
+        check_args = _timed(check_args, _stats_entry(name, *_arg_schemas(schemas)))
+        returns = returns and _timed(returns, _stats_entry(name + ' returns', schemas['returns']))
+    fill_args = _defaults_plan(decoratee, schemas)
+    fill_returns = _defaults(schemas['returns'])
     @functools.wraps(decoratee)
     def decorated(*args, **kwargs):
-        with util.exceptions.update('schema.check failed for args to function:\n  {}'.format(name), AssertionError, when=lambda x: 'failed for ' not in x):
-            if args and decoratee.__code__ is getattr(getattr(args[0], decoratee.__name__, None), '__orig_code__', None):
-                a, kwargs = _check_args(args[1:], kwargs, name, schemas)
-                args = [args[0]] + a
-            else:
-                args, kwargs = _check_args(args, kwargs, name, schemas)
+        state = checking.state
+        if state is not None:
+            if state is False:
+                return decoratee(*args, **kwargs)
+            if state is _profiled:
+                return (checking.profiled or checking.profile())(*args, **kwargs)
+            if not state(*args, **kwargs):
+                return _call_unsampled(decoratee, fill_args, fill_returns, args, kwargs)
+        args, kwargs = check_args(args, kwargs)
         value = decoratee(*args, **kwargs)
-        with util.exceptions.update('schema.check failed for return value of function:\n {}'.format(name), AssertionError):
-            output = validate(schemas['returns'], value)
-        return output
+        if returns is None:
+            return value
+        try:
+            return returns(value)
+        except AssertionError:
+            with util.exceptions.update('schema.check failed for return value of function:\n {}'.format(name), AssertionError):
+                raise
     decorated.__orig_code__ = decoratee.__code__
     return decorated
 
-def _gen_check(decoratee, name, schemas):
+def _gen_check(decoratee, name, schemas, checking, profile=False):
+    check_args = _args_plan(decoratee, name, schemas, 'schema.check failed for generator:\n  {}')
+    yields, sends, returns, chunks = _gen_nodes(name, schemas, profile)
+    if profile:
+        check_args = _timed(check_args, _stats_entry(name, *_arg_schemas(schemas)))
+    fill_args = _defaults_plan(decoratee, schemas)
+    fill_returns = _defaults(schemas['returns'])
+    fill_yields = _defaults(schemas['yields'])
+    fill_sends = _defaults(schemas['sends'])
+    every = schemas['yields_every'] or 1
     @functools.wraps(decoratee)
     def decorated(*args, **kwargs):
-        with util.exceptions.update('schema.check failed for generator:\n  {}'.format(name), AssertionError, when=lambda x: 'failed for ' not in x):
-            if args and decoratee.__code__ is getattr(getattr(args[0], decoratee.__name__, None), '__orig_code__', None):
-                a, kwargs = _check_args(args[1:], kwargs, name, schemas)
-                args = [args[0]] + a
+        state = checking.state
+        if state is False:
+            return (yield from decoratee(*args, **kwargs))
+        if state is _profiled:
+            return (yield from (checking.profiled or checking.profile())(*args, **kwargs))
+        if state is not None and not state(*args, **kwargs):
+            if fill_args:
+                args, kwargs = fill_args(args, kwargs)
+            if fill_yields or fill_sends:
+                value = yield from _gen_filled(decoratee(*args, **kwargs), fill_yields, fill_sends)
             else:
-                args, kwargs = _check_args(args, kwargs, name, schemas)
+                value = yield from decoratee(*args, **kwargs)
+            return fill_returns(value) if fill_returns else value
+        args, kwargs = check_args(args, kwargs)
         generator = decoratee(*args, **kwargs)
+        if chunks:
+            value = yield from _gen_chunks(generator, chunks, schemas['yields_chunk'], name)
+        elif yields is None and sends is None:
+            value = yield from generator
+        else:
+            # the success path costs one validator call per item, context is only added to errors
+            send, throw = generator.send, generator.throw
+            to_send = None
+            exception = None
+            skip = 0
+            while True:
+                try:
+                    if exception is None:
+                        to_yield = send(to_send)
+                    else:
+                        to_yield, exception = throw(exception), None
+                except StopIteration as e:
+                    value = e.value
+                    break
+                if skip:
+                    skip -= 1
+                    if fill_yields:
+                        to_yield = fill_yields(to_yield)
+                elif yields is not None:
+                    skip = every - 1
+                    try:
+                        to_yield = yields(to_yield)
+                    except AssertionError:
+                        _gen_failed('yield', name)
+                try:
+                    to_send = yield to_yield
+                except BaseException as e:
+                    exception = e
+                    continue
+                if sends is not None:
+                    try:
+                        to_send = sends(to_send)
+                    except AssertionError:
+                        _gen_failed('send', name)
+        if returns is None:
+            return value
+        try:
+            return returns(value)
+        except AssertionError:
+            _gen_failed('return', name)
+    decorated.__orig_code__ = decoratee.__code__
+    return decorated
+
+def _gen_nodes(name, schemas, profile):
+    # object schemas are not validated at all, unless profiled, so every item is counted
+    assert not (schemas['yields_every'] and schemas['yields_chunk']), 'validate yields with one of yields_every=<n> or yields_chunk=<n>, not both: {}'.format(name)
+    assert not schemas['yields_chunk'] or schemas['sends'] is object, 'a generator with yields_chunk=<n> cannot be sent values: {}'.format(name)
+    kinds = [('yields', schemas['yields']), ('sends', schemas['sends']), ('returns', schemas['returns'])]
+    if schemas['yields_chunk']:
+        kinds.append(('yields', [schemas['yields']]))
+    nodes = [None] * 4
+    for i, (kind, schema) in enumerate(kinds):
+        if profile:
+            nodes[i] = _timed(_compiled(schema), _stats_entry('{} {}'.format(name, kind), schema))
+        elif schema is not object and schema != [object]:
+            nodes[i] = _compiled(schema)
+    return nodes
+
+def _gen_failed(kind, name):
+    with util.exceptions.update('schema.check failed for {} value of generator:\n {}'.format(kind, name), AssertionError):
+        raise
+
+def _gen_filled(generator, fill_yields, fill_sends):
+    # fills in :optional defaults of the yields and sends of a call which is not sampled
+    send, throw = generator.send, generator.throw
+    to_send = None
+    exception = None
+    while True:
+        try:
+            if exception is None:
+                to_yield = send(to_send)
+            else:
+                to_yield, exception = throw(exception), None
+        except StopIteration as e:
+            return e.value
+        if fill_yields:
+            to_yield = fill_yields(to_yield)
+        try:
+            to_send = yield to_yield
+        except BaseException as e:
+            exception = e
+            continue
+        if fill_sends:
+            to_send = fill_sends(to_send)
+
+def _gen_chunks(generator, chunks, size, name):
+    # items are read ahead, and validated with one call per chunk. exceptions are thrown into
+    # the generator, which is ahead by the rest of the chunk, and items it yields in reply
+    # start the next chunk
+    chunk = []
+    done = False
+    while True:
+        try:
+            while not done and len(chunk) < size:
+                chunk.append(next(generator))
+        except StopIteration as e:
+            value, done = e.value, True
+        try:
+            chunk = chunks(chunk)
+        except AssertionError:
+            _gen_failed('yield', name)
+        replies = []
+        for x in chunk:
+            try:
+                sent = yield x
+            except GeneratorExit:
+                generator.close()
+                raise
+            except BaseException as e:
+                try:
+                    replies.append(generator.throw(e))
+                except StopIteration as stop:
+                    value, done = stop.value, True
+                continue
+            if sent is not None:
+                raise AssertionError('a generator with yields_chunk=<n> cannot be sent values: {}'.format(name))
+        if done and not replies:
+            return value
+        chunk = replies
+
+def _asyncgen_check(decoratee, name, schemas, checking, profile=False):
+    # async generators cannot return values, so there is no return value to check
+    check_args = _args_plan(decoratee, name, schemas, 'schema.check failed for async generator:\n  {}')
+    yields, sends, _, chunks = _gen_nodes(name, schemas, profile)
+    if profile:
+        check_args = _timed(check_args, _stats_entry(name, *_arg_schemas(schemas)))
+    fill_args = _defaults_plan(decoratee, schemas)
+    fill_yields = _defaults(schemas['yields'])
+    fill_sends = _defaults(schemas['sends'])
+    every = schemas['yields_every'] or 1
+    size = schemas['yields_chunk']
+    @functools.wraps(decoratee)
+    async def decorated(*args, **kwargs):
+        state = checking.state
+        _yields, _sends, _every = yields, sends, every
+        if state is False:
+            generator = decoratee(*args, **kwargs)
+            _yields = _sends = None
+        elif state is _profiled:
+            generator = (checking.profiled or checking.profile())(*args, **kwargs)
+            _yields = _sends = None
+        elif state is not None and not state(*args, **kwargs):
+            if fill_args:
+                args, kwargs = fill_args(args, kwargs)
+            generator = decoratee(*args, **kwargs)
+            _yields, _sends, _every = fill_yields, fill_sends, 1
+        else:
+            args, kwargs = check_args(args, kwargs)
+            generator = decoratee(*args, **kwargs)
+            if chunks: # like _gen_chunks
+                anext = generator.__anext__
+                chunk = []
+                done = False
+                while True:
+                    try:
+                        while not done and len(chunk) < size:
+                            chunk.append(await anext())
+                    except StopAsyncIteration:
+                        done = True
+                    try:
+                        chunk = chunks(chunk)
+                    except AssertionError:
+                        _gen_failed('yield', name)
+                    replies = []
+                    for x in chunk:
+                        try:
+                            sent = yield x
+                        except GeneratorExit:
+                            await generator.aclose()
+                            raise
+                        except BaseException as e:
+                            try:
+                                replies.append(await generator.athrow(e))
+                            except StopAsyncIteration:
+                                done = True
+                            continue
+                        if sent is not None:
+                            raise AssertionError('a generator with yields_chunk=<n> cannot be sent values: {}'.format(name))
+                    if done and not replies:
+                        return
+                    chunk = replies
+        asend, athrow = generator.asend, generator.athrow
         to_send = None
-        first_send = True
-        send_exception = False
+        exception = None
+        skip = 0
         while True:
-            if not first_send:
-                with util.exceptions.update('schema.check failed for send value of generator:\n {}'.format(name), AssertionError):
-                    to_send = validate(schemas['sends'], to_send)
-            first_send = False
             try:
-                if send_exception:
-                    to_yield = generator.throw(*send_exception)
-                    send_exception = False
+                if exception is None:
+                    to_yield = await asend(to_send)
                 else:
-                    to_yield = generator.send(to_send)
-                with util.exceptions.update('schema.check failed for yield value of generator:\n {}'.format(name), AssertionError):
-                    to_yield = validate(schemas['yields'], to_yield)
-            except StopIteration as e:
-                with util.exceptions.update('schema.check failed for return value of generator:\n {}'.format(name), AssertionError):
-                    return validate(schemas['returns'], getattr(e, 'value', None))
+                    to_yield, exception = await athrow(exception), None
+            except StopAsyncIteration:
+                return
+            if skip:
+                skip -= 1
+                if fill_yields:
+                    to_yield = fill_yields(to_yield)
+            elif _yields is not None:
+                skip = _every - 1
+                try:
+                    to_yield = _yields(to_yield)
+                except AssertionError:
+                    _gen_failed('yield', name)
             try:
                 to_send = yield to_yield
-            except:
-                send_exception = sys.exc_info()
+            except BaseException as e:
+                exception = e
+                continue
+            if _sends is not None:
+                try:
+                    to_send = _sends(to_send)
+                except AssertionError:
+                    _gen_failed('send', name)
     decorated.__orig_code__ = decoratee.__code__
     return decorated
 
-def _coroutine_check(decoratee, name, schemas):
+def _coroutine_check(decoratee, name, schemas, checking, profile=False):
+    check_args = _args_plan(decoratee, name, schemas, 'schema.check failed for coroutine:\n  {}')
+    returns = _returns_node(schemas['returns'])
+    if profile:
+        check_args = _timed(check_args, _stats_entry(name, *_arg_schemas(schemas)))
+        returns = returns and _timed(returns, _stats_entry(name + ' returns', schemas['returns']))
+    fill_args = _defaults_plan(decoratee, schemas)
+    fill_returns = _defaults(schemas['returns'])
+    offload = schemas['offload']
+    executor = None if offload is True else offload
     @functools.wraps(decoratee)
     async def decorated(*args, **kwargs):
-        with util.exceptions.update('schema.check failed for coroutine:\n  {}'.format(name), AssertionError, when=lambda x: 'failed for ' not in x):
-            if args and decoratee.__code__ is getattr(getattr(args[0], decoratee.__name__, None), '__orig_code__', None):
-                a, kwargs = _check_args(args[1:], kwargs, name, schemas)
-                args = [args[0]] + a
+        state = checking.state
+        if state is False:
+            return await decoratee(*args, **kwargs)
+        if state is _profiled:
+            return await (checking.profiled or checking.profile())(*args, **kwargs)
+        if state is not None and not state(*args, **kwargs):
+            if fill_args:
+                args, kwargs = fill_args(args, kwargs)
+            value = await decoratee(*args, **kwargs)
+            return fill_returns(value) if fill_returns else value
+        if offload:
+            args, kwargs = await _offload((args, kwargs), executor, None, check_args, args, kwargs)
+        else:
+            args, kwargs = check_args(args, kwargs)
+        try:
+            value = await decoratee(*args, **kwargs)
+            if returns is None:
+                return value
+            elif offload:
+                return await _offload(value, executor, None, returns, value)
             else:
-                args, kwargs = _check_args(args, kwargs, name, schemas)
-            val = await decoratee(*args, **kwargs)
-            return validate(schemas['returns'], val)
+                return returns(value)
+        except AssertionError:
+            with util.exceptions.update('schema.check failed for coroutine:\n  {}'.format(name), AssertionError, when=lambda x: 'failed for ' not in x):
+                raise
     decorated.__orig_code__ = decoratee.__code__
     return decorated
 
@@ -435,16 +3100,21 @@ def _coroutine_check(decoratee, name, schemas):
 def check(*args, **kwargs):
     # TODO add doctest with :fn and args/kwargs
     def decorator(decoratee):
-        if disabled:
-            return decoratee
         name = util.func.name(decoratee)
         schemas = _get_schemas(decoratee, args, kwargs)
+        checking = _Checking(decoratee.__module__)
+        assert not schemas['offload'] or inspect.iscoroutinefunction(decoratee), 'offload is only for coroutines, not: {}'.format(name)
         if inspect.iscoroutinefunction(decoratee):
-            decorated = _coroutine_check(decoratee, name, schemas)
+            wrap = _coroutine_check
+        elif inspect.isasyncgenfunction(decoratee):
+            wrap = _asyncgen_check
         elif inspect.isgeneratorfunction(decoratee):
-            decorated = _gen_check(decoratee, name, schemas)
+            wrap = _gen_check
         else:
-            decorated = _fn_check(decoratee, name, schemas)
+            wrap = _fn_check
+        decorated = wrap(decoratee, name, schemas, checking)
+        checking.build = lambda: wrap(decoratee, name, schemas, checking.inner, profile=True)
+        decorated._checking = checking
         decorated._schema = schemas['arg'], {k: v for k, v in list(schemas['kwarg'].items()) + [['returns', schemas['returns']]]}
         return decorated
     return decorator
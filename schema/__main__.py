@@ -0,0 +1,18 @@
+"""
+python -m schema compile mypkg.schemas [more.schemas ...]
+"""
+import argparse
+import schema
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m schema')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    compile = commands.add_parser('compile', help='save the generated validators for the schemas of modules, see schema.precompile')
+    compile.add_argument('modules', nargs='+')
+    args = parser.parse_args()
+    for module in args.modules:
+        print(schema.precompile(module))
+
+if __name__ == '__main__':
+    main()
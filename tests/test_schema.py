@@ -1,10 +1,16 @@
+import array
 import collections
+import concurrent.futures
 import io
+import json
+import os
 import pytest
+import threading
 import util.dicts
 import tornado.concurrent
 import tornado.ioloop
 import tornado.gen
+import schema
 from schema import validate, check
 
 # TODO queues
@@ -117,6 +123,45 @@ def test_check_coroutines():
     with pytest.raises(AssertionError):
         tornado.ioloop.IOLoop.instance().run_sync(lambda: main(-1))
 
+def test_check_coroutines_offload(monkeypatch):
+    monkeypatch.setattr(schema, '_offload_size', 0)
+    threads = []
+    @check(offload=True)
+    async def main(x: lambda x: threads.append(threading.current_thread()) or True) -> float:
+        return x
+    assert tornado.ioloop.IOLoop.instance().run_sync(lambda: main(1.0)) == 1.0
+    assert threads and threads[0] is not threading.current_thread()
+    with pytest.raises(AssertionError):
+        tornado.ioloop.IOLoop.instance().run_sync(lambda: main('a'))
+
+def test_check_parameters_named_like_options(monkeypatch):
+    monkeypatch.setattr(schema, '_offload_size', 0)
+    @check
+    async def handler(rows: [int], offload: bool = False) -> int:
+        return len(rows)
+    assert tornado.ioloop.IOLoop.instance().run_sync(lambda: handler([1, 2], offload=True)) == 2
+    @check
+    def fn(x: int, offload: bool = False, yields_every: int = 0, yields_chunk: int = 0) -> int:
+        return x
+    assert fn(1, offload=True, yields_every=2, yields_chunk=3) == 1
+
+def test_avalidate():
+    run = tornado.ioloop.IOLoop.instance().run_sync
+    assert run(lambda: schema.avalidate({'a': int}, {'a': 1})) == {'a': 1}
+    with pytest.raises(schema.ValidationError):
+        run(lambda: schema.avalidate({'a': int}, {'a': '1'}))
+    f = concurrent.futures.Future()
+    set_result = f.set_result
+    f.set_result({'a': 1})
+    assert run(lambda: schema.avalidate({'a': int}, f)) == {'a': 1}
+    assert f.set_result == set_result # awaited, not patched
+    threads = []
+    sc = [lambda x: threads.append(threading.current_thread()) or True]
+    assert run(lambda: schema.avalidate(sc, list(range(10)), offload_size=100)) == list(range(10))
+    assert threads[-1] is threading.current_thread()
+    assert run(lambda: schema.avalidate(sc, list(range(100)), offload_size=100)) == list(range(100))
+    assert threads[-1] is not threading.current_thread()
+
 def test_check_generator():
     @tornado.gen.coroutine
     @check
@@ -151,6 +196,98 @@ def test_check_yields_and_sends():
     with pytest.raises(AssertionError):
         gen.send('1') # violate sends
 
+def test_check_generator_throw():
+    @check(yields=int)
+    def main():
+        try:
+            yield 1
+        except KeyError:
+            yield 2
+    gen = main()
+    assert next(gen) == 1
+    assert gen.throw(KeyError()) == 2
+    gen = main()
+    next(gen)
+    with pytest.raises(ValueError):
+        gen.throw(ValueError())
+
+def test_check_yields_every():
+    @check(yields={'a': int, 'b': (':optional', int, 0)}, yields_every=2)
+    def main():
+        yield {'a': 1}
+        yield {'a': 'unchecked'}
+        yield {'a': 'checked'}
+    gen = main()
+    assert next(gen) == {'a': 1, 'b': 0}
+    assert next(gen) == {'a': 'unchecked', 'b': 0}
+    with pytest.raises(AssertionError):
+        next(gen)
+
+def test_check_yields_chunk():
+    @check(yields=int, yields_chunk=2)
+    def main(n: int) -> str:
+        yield from range(n)
+        return 'done'
+    def run(gen):
+        try:
+            while True:
+                next(gen)
+        except StopIteration as e:
+            return e.value
+    assert list(main(5)) == [0, 1, 2, 3, 4]
+    assert run(main(4)) == 'done'
+    @check(yields=int, yields_chunk=2)
+    def main():
+        yield 1
+        yield 2
+        yield 'a'
+    gen = main()
+    assert next(gen) == 1 and next(gen) == 2
+    with pytest.raises(AssertionError):
+        next(gen)
+
+def test_check_yields_chunk_throw():
+    events = []
+    @check(yields=int, yields_chunk=2)
+    def main():
+        try:
+            yield 1
+            yield 2
+        except KeyError:
+            yield 3
+            yield 4
+        finally:
+            events.append('finally')
+    gen = main()
+    assert next(gen) == 1
+    assert gen.throw(KeyError) == 2 # the generator is ahead by the rest of the chunk
+    assert list(gen) == [3, 4]
+    assert events == ['finally']
+    gen = main()
+    next(gen)
+    gen.close()
+    assert events == ['finally'] * 2
+
+def test_check_async_generator():
+    @check(yields=int, sends=(':or', int, None))
+    async def main(x: int):
+        y = yield x
+        yield y
+    async def run(*args):
+        gen = main(*args)
+        return [await gen.asend(None), await gen.asend(2)]
+    assert tornado.ioloop.IOLoop.instance().run_sync(lambda: run(1)) == [1, 2]
+    with pytest.raises(AssertionError):
+        tornado.ioloop.IOLoop.instance().run_sync(lambda: run('1'))
+    @check(yields=int, yields_chunk=2)
+    async def main():
+        for x in [1, 2, 'a']:
+            yield x
+    async def run():
+        return [x async for x in main()]
+    with pytest.raises(AssertionError):
+        tornado.ioloop.IOLoop.instance().run_sync(run)
+
 def test_method():
     class Foo(object):
         @check
@@ -165,6 +302,229 @@ def test_method():
     with pytest.raises(AssertionError):
         Foo().bar(0)
 
+def test_check_object_schemas_pass_through():
+    @check
+    def fn(a: object, b: object = None, *rest: object, **kw: object) -> object:
+        return a, b, rest, kw
+    assert fn(1, b=2) == (1, 2, (), {})
+    assert fn(1, 2, 3, c=4) == (1, 2, (3,), {'c': 4})
+
+def test_check_error_messages():
+    @check
+    def fn(a: int, b: float = 0) -> str:
+        return str(a + b)
+    with pytest.raises(AssertionError) as e:
+        fn('1')
+    assert 'pos arg num:\n  0' in str(e.value)
+    assert 'schema.check failed for args to function' in str(e.value)
+    with pytest.raises(AssertionError) as e:
+        fn(1, b='2')
+    assert 'keyword arg:\n  b' in str(e.value)
+    with pytest.raises(AssertionError) as e:
+        fn(1, 2)
+    assert 'for 1 pos args, but 2 were provided' in str(e.value)
+
+def test_sampling():
+    @check
+    def fn(a: int, opts: {'verbose': (':optional', bool, False)}) -> str:
+        return str(opts)
+    schema.set_sampling(every=2, scope=fn)
+    try:
+        with pytest.raises(AssertionError):
+            fn('1', {})
+        assert fn('1', {}) == "{'verbose': False}"
+        with pytest.raises(AssertionError):
+            fn('1', {})
+        with pytest.raises(AssertionError):
+            validate(int, '1')
+    finally:
+        schema.set_sampling(scope=fn)
+    with pytest.raises(AssertionError):
+        fn('1', {})
+
+def test_sampling_generator_defaults():
+    sent = []
+    @check(yields={'a': int, 'b': (':optional', int, 0)}, sends={'c': (':optional', int, 1)})
+    def gen():
+        sent.append((yield {'a': 1}))
+        sent.append((yield {'a': 2}))
+    schema.set_sampling(every=2, scope=gen)
+    try:
+        for _ in range(2):
+            g = gen()
+            assert next(g) == {'a': 1, 'b': 0}
+            assert g.send({}) == {'a': 2, 'b': 0}
+            with pytest.raises(StopIteration):
+                g.send({'c': 2})
+    finally:
+        schema.set_sampling(scope=gen)
+    assert sent == [{'c': 1}, {'c': 2}] * 2
+
+def test_sampling_by_key():
+    seen = []
+    @check
+    def fn(user: str) -> str:
+        seen.append(user)
+        return 123
+    schema.set_sampling(every=4, key=lambda user: user)
+    try:
+        checked = set()
+        for user in ['user-{}'.format(i) for i in range(20)] * 2:
+            try:
+                fn(user)
+            except AssertionError:
+                checked.add(user)
+        assert checked and len(checked) < 20
+        for user in checked:
+            with pytest.raises(AssertionError):
+                fn(user)
+        assert validate({'a': (':optional', int, 0)}, {}) == {'a': 0}
+    finally:
+        schema.set_sampling()
+
+def test_sampling_per_second():
+    @check
+    def fn(a: int):
+        return a
+    schema.set_sampling(per_second=3, scope=fn)
+    try:
+        errors = 0
+        for _ in range(10):
+            try:
+                fn('1')
+            except AssertionError:
+                errors += 1
+        assert errors == 3
+    finally:
+        schema.set_sampling(scope=fn)
+
+def test_set_mode():
+    @check
+    def fn(a: int) -> int:
+        return a
+    schema.set_mode('off')
+    try:
+        assert fn('1') == '1'
+        assert validate(int, '1') == '1'
+        schema.set_mode('full', scope=__name__)
+        with pytest.raises(AssertionError):
+            fn('1')
+        with pytest.raises(AssertionError):
+            validate(int, '1')
+        schema.set_mode('off', scope=fn)
+        assert fn('1') == '1'
+        schema.set_mode(None, scope=fn)
+        with pytest.raises(AssertionError):
+            fn('1')
+    finally:
+        schema.set_mode(None, scope=fn)
+        schema.set_mode(None, scope=__name__)
+        schema.set_mode(None)
+    with pytest.raises(AssertionError):
+        fn('1')
+
+def test_set_mode_full_ignores_sampling():
+    @check
+    def fn(a: int) -> int:
+        return a
+    schema.set_sampling(every=1000, scope=fn)
+    try:
+        fn(1)
+        assert fn('1') == '1'
+        schema.set_mode('full', scope=fn)
+        with pytest.raises(AssertionError):
+            fn('1')
+    finally:
+        schema.set_mode(None, scope=fn)
+        schema.set_sampling(scope=fn)
+
+def test_profile():
+    @check
+    def fn(a: int) -> str:
+        return str(a) if a else a
+    @check
+    def gen() -> int:
+        yield (yield 1)
+        return 2
+    schema.stats(clear=True)
+    schema.profile()
+    try:
+        fn(1)
+        with pytest.raises(AssertionError):
+            fn(0)
+        with pytest.raises(AssertionError):
+            fn('1')
+        g = gen()
+        next(g)
+        g.send(3)
+        with pytest.raises(StopIteration):
+            next(g)
+        validate([int], [1, 2])
+    finally:
+        schema.profile(False)
+    fn(1)
+    results = schema.stats(clear=True)
+    name = util.func.name(fn)
+    assert results[name]['calls'] == 3 and results[name]['failures'] == 1
+    assert results[name + ' returns']['calls'] == 2 and results[name + ' returns']['failures'] == 1
+    assert results[util.func.name(gen) + ' yields']['calls'] == 2
+    [validated] = [v for k, v in results.items() if k.startswith(__file__)]
+    assert validated['calls'] == 1 and validated['nodes'] == 2
+    assert json.loads(json.dumps(results)) == results
+
+def test_profile_collect():
+    schema.profile()
+    try:
+        with pytest.raises(schema.ValidationError) as e:
+            validate({'a': int, 'b': str}, {'a': '1', 'b': 2}, collect=True)
+    finally:
+        schema.profile(False)
+    schema.stats(clear=True)
+    assert sorted(x.path for x in e.value.errors) == [['a'], ['b']]
+
+def test_profile_inline_schemas():
+    schema.stats(clear=True)
+    schema.profile()
+    try:
+        for i in range(5):
+            validate({'a': int}, {'a': i})
+    finally:
+        schema.profile(False)
+    assert len(schema._profiles_by_id) == 1
+    [(name, result)] = schema.stats(clear=True).items()
+    assert name.startswith(__file__) and result['calls'] == 5
+
+def test_profile_avalidate():
+    sc = [int]
+    async def main(value):
+        return await schema.avalidate(sc, value, offload_size=100)
+    run = lambda value: tornado.ioloop.IOLoop.instance().run_sync(lambda: main(value))
+    schema.stats(clear=True)
+    schema.profile()
+    try:
+        assert run([1]) == [1]
+        assert run(list(range(100))) == list(range(100)) # offloaded
+        schema.set_mode('off')
+        schema.set_mode('full', scope=__name__)
+        with pytest.raises(schema.ValidationError):
+            run(['1'] * 100)
+    finally:
+        schema.set_mode(None, scope=__name__)
+        schema.set_mode(None)
+        schema.profile(False)
+    [(name, result)] = schema.stats(clear=True).items()
+    assert name.startswith(__file__) and result['calls'] == 3 and result['failures'] == 1
+
+def test_classmethod():
+    class Foo(object):
+        @classmethod
+        @check
+        def bar(cls, x: int) -> str:
+            return str(x)
+    assert Foo.bar(1) == '1'
+    with pytest.raises(AssertionError):
+        Foo.bar('1')
+
 def test_method_like_arg():
     @check
     def read(f: io.IOBase) -> str:
@@ -202,6 +562,241 @@ def test_args():
     with pytest.raises(AssertionError):
         fn(1, 2.0)
 
+def test_compile():
+    fn = schema.compile({'name': str, 'age': (':optional', int, 0), 'tags': [str]})
+    assert fn({'name': 'jane', 'tags': ['a']}) == {'name': 'jane', 'age': 0, 'tags': ['a']}
+    assert fn({'name': 'john', 'age': 1, 'tags': []}) == {'name': 'john', 'age': 1, 'tags': []}
+    with pytest.raises(AssertionError):
+        fn({'name': 'jane', 'tags': [1]})
+    with pytest.raises(AssertionError):
+        fn({'tags': []})
+
+def test_compile_exact_match():
+    fn = schema.compile({'a': int}, exact_match=True)
+    assert fn({'a': 1}) == {'a': 1}
+    with pytest.raises(AssertionError):
+        fn({'a': 1, 'b': 2})
+    assert schema.compile({'a': int})({'a': 1, 'b': 2}) == {'a': 1}
+
+def test_compile_invalid_schemas_fail_at_validation_time():
+    fn = schema.compile((':or', int, [str, str]))
+    assert fn(1) == 1
+    with pytest.raises(AssertionError):
+        fn(['a'])
+
+def test_cache():
+    schema.cache_clear()
+    sc = {'a': [int]}
+    validate(sc, {'a': [1]})
+    assert schema.is_valid(sc, {'a': [1]})
+    assert not schema.is_valid(sc, {'a': ['1']})
+    info = schema.cache_info()
+    assert info.misses == 1 and info.hits == 2
+    validate({'a': [int]}, {'a': [1]}) # structurally equal schema built inline
+    assert schema.cache_info().misses == 1
+    validate({'a': [float]}, {'a': [1.0]})
+    assert schema.cache_info().misses == 2
+    schema.cache_clear()
+    assert schema.cache_info() == (0, 0, schema.cache_info().maxsize, 0)
+
+def test_cache_literal_types_are_distinct():
+    schema.cache_clear()
+    assert validate({'a': 1}, {'a': 1}) == {'a': 1}
+    assert validate({'a': 1.0}, {'a': 1}) == {'a': 1}
+    assert schema.cache_info().misses == 2
+
+def test_cache_inline_lambdas():
+    schema.cache_clear()
+    for _ in range(3):
+        assert validate({'a': lambda x: x > 0}, {'a': 1}) == {'a': 1}
+    assert schema.cache_info().misses == 1 and schema.cache_info().currsize == 2
+    def check(n):
+        return schema.is_valid({'a': lambda x: x > n}, {'a': 1})
+    assert [check(0), check(2), check(0), check(2)] == [True, False, True, False]
+    assert schema.cache_info().misses == 3
+
+def test_cache_unhashable_literals():
+    class Unhashable:
+        __hash__ = None
+        def __eq__(self, other):
+            return isinstance(other, Unhashable)
+    assert validate(bytearray(b'a'), bytearray(b'a')) == bytearray(b'a')
+    assert isinstance(validate({'a': Unhashable()}, {'a': Unhashable()})['a'], Unhashable)
+
+def test_dict_key_dispatch_precedence():
+    sc = {'a': 'apple',
+          str: int,
+          lambda x: isinstance(x, int): float,
+          object: bool}
+    assert validate(sc, {'a': 'apple', 'b': 1, 2: 2.0, None: True}) == {'a': 'apple', 'b': 1, 2: 2.0, None: True}
+    with pytest.raises(AssertionError):
+        validate(sc, {'a': 'apple', 'b': 1.0})
+    with pytest.raises(AssertionError):
+        validate(sc, {'a': 'apple', 2: 2})
+    with pytest.raises(AssertionError):
+        validate(sc, {'a': 'apple', None: None})
+
+def test_optional_mutable_defaults_are_not_shared():
+    sc = {'a': (':optional', [int], [])}
+    x = validate(sc, {})
+    x['a'].append(1)
+    assert validate(sc, {}) == {'a': []}
+
+def test_optional_default_which_raises():
+    sc = {'a': (':optional', lambda x: x > 0, None)}
+    assert validate(sc, {'a': 1}) == {'a': 1}
+    assert validate([sc], [{'a': 1}] * 20) == [{'a': 1}] * 20
+    with pytest.raises(TypeError):
+        validate(sc, {})
+    @check
+    def fn(opts: sc) -> dict:
+        return opts
+    assert fn({'a': 1}) == {'a': 1}
+
+def test_wide_dict_missing_key():
+    sc = {str(i): int for i in range(100)}
+    value = {str(i): i for i in range(100)}
+    assert validate(sc, value) == value
+    del value['50']
+    with pytest.raises(AssertionError):
+        validate(sc, value)
+
+def test_is_valid():
+    sc = {'a': [int], 'b': (':or', str, None), 'c': (':optional', float, 1.0)}
+    assert schema.is_valid(sc, {'a': [1], 'b': None})
+    assert not schema.is_valid(sc, {'a': [1, '2'], 'b': None})
+    assert not schema.is_valid(sc, {'a': [1]})
+    assert not schema.is_valid(sc, {'a': [1], 'b': None, 'c': 1})
+    assert not schema.is_valid(sc, None)
+
+def test_is_valid_intersection_sees_previous_output():
+    sc = (':and', {'name': (':optional', object, 'bob')}, {'name': int})
+    assert schema.is_valid(sc, {'name': 1})
+    assert not schema.is_valid(sc, {})
+
+def test_matcher():
+    on_msg = schema.Matcher([((':order', {'id': int}), lambda msg: ('order', msg)),
+                             ((':order', object), lambda msg: ('bad-order', msg)),
+                             ({'name': (':optional', str, 'bob')}, lambda msg: ('user', msg)),
+                             (int, lambda msg: ('int', msg))])
+    assert on_msg([':order', {'id': 1}]) == ('order', [':order', {'id': 1}])
+    assert on_msg((b':order', {'id': 1})) == ('order', [':order', {'id': 1}])
+    assert on_msg([':order', {'id': '1'}]) == ('bad-order', [':order', {'id': '1'}])
+    assert on_msg({}) == ('user', {'name': 'bob'})
+    assert on_msg(1) == ('int', 1)
+    with pytest.raises(AssertionError):
+        on_msg(1.0)
+    with pytest.raises(AssertionError):
+        on_msg([':shutdown'])
+
+def test_matcher_future_is_patched_once():
+    calls = []
+    matcher = schema.Matcher([({'a': lambda x: calls.append(x) or True}, lambda msg: msg)])
+    f = tornado.concurrent.Future()
+    assert matcher({'a': f})['a'] is f
+    f.set_result(1)
+    assert calls == [1]
+    matcher = schema.Matcher([(lambda x: calls.append(x) or True, lambda msg: msg)])
+    f = tornado.concurrent.Future()
+    assert matcher(f) is f
+    f.set_result(2)
+    assert calls == [1, 2]
+
+def test_matcher_first_match_wins():
+    on_msg = schema.Matcher([(object, lambda msg: 'any'),
+                             ((':order', int), lambda msg: 'order')])
+    assert on_msg([':order', 1]) == 'any'
+    assert schema.match([':order', 1], [((':order', int), lambda msg: msg[1])]) == 1
+    assert schema.match(None, [(int, lambda msg: msg)], default=lambda msg: 'default') == 'default'
+
+def test_validate_without_copying():
+    sc = {'a': [{'b': int}], 'c': (str, bytes)}
+    value = {'a': [{'b': 1}, {'b': 2}], 'c': ['x', b'y']}
+    assert validate(sc, value, copy=False) is value
+    value = {'a': [{'b': 1}, {'b': 2, 'drop': 1}], 'c': ('x', b'y')}
+    new = validate(sc, value, copy=False)
+    assert new == {'a': [{'b': 1}, {'b': 2}], 'c': ('x', b'y')}
+    assert new is not value and new['a'] is not value['a']
+    assert new['a'][0] is value['a'][0] and new['c'] is value['c']
+    assert value['a'][1] == {'b': 2, 'drop': 1}
+
+def test_validate_without_copying_decodes_and_fills_defaults():
+    sc = {'a': 'x', 'b': (':optional', [int], [])}
+    value = {'a': b'x', 'b': [1]}
+    assert validate(sc, value, copy=False) == {'a': 'x', 'b': [1]}
+    value = {'a': 'x'}
+    assert validate(sc, value, copy=False) == {'a': 'x', 'b': []}
+    assert value == {'a': 'x'}
+    with pytest.raises(AssertionError):
+        validate(sc, {'a': 'y'}, copy=False)
+    with pytest.raises(AssertionError):
+        validate(sc, {'b': []}, copy=False)
+
+def test_validate_stream():
+    sc = [{'id': int, 'name': (':optional', str, '')}]
+    records = ({'id': i} for i in range(3))
+    assert list(schema.validate_stream(sc, records)) == [{'id': 0, 'name': ''}, {'id': 1, 'name': ''}, {'id': 2, 'name': ''}]
+    with pytest.raises(AssertionError) as e:
+        list(schema.validate_stream(sc, [{'id': 0}, {'id': '1'}]))
+    assert 'element num:\n  1' in str(e.value)
+    with pytest.raises(AssertionError):
+        schema.validate_stream({'id': int}, [])
+
+def test_validate_stream_collect_errors():
+    errors = []
+    assert list(schema.validate_stream([int], [1, 'a', 2, None], errors=errors)) == [1, 2]
+    assert [i for i, _ in errors] == [1, 3]
+    assert all(isinstance(e, AssertionError) for _, e in errors)
+
+def test_validate_jsonl():
+    data = io.BytesIO(b'{"id": 1}\n\n{"id": "2"}\n{"id": \n{"id": 4}\n')
+    errors = []
+    assert list(schema.validate_jsonl([{'id': int}], data, errors=errors)) == [{'id': 1}, {'id': 4}]
+    assert [i for i, _ in errors] == [2, 3]
+
+def test_validate_json_array():
+    text = '[{"id": 1}, {"id": 2.5}, {"id": -30}]'
+    for f in [io.StringIO(text), io.BytesIO(text.encode())]:
+        assert list(schema.validate_json_array([{'id': (':or', int, float)}], f)) == [{'id': 1}, {'id': 2.5}, {'id': -30}]
+    assert list(schema.validate_json_array([int], io.StringIO('[]'))) == []
+    with pytest.raises(ValueError):
+        list(schema.validate_json_array([int], io.StringIO('[1, 2')))
+    items = schema._json_array_items(io.StringIO('[12345, "abcdef", {"a": [1, 2.5e3]}]'), size=2)
+    assert list(items) == [12345, 'abcdef', {'a': [1, 2500.0]}]
+
+def test_validate_many():
+    sc = {'id': int, 'name': (':optional', str, 'x')}
+    values, errors = schema.validate_many(sc, [{'id': 1}, {'id': '2'}, None, {'id': 3, 'name': 'y'}])
+    assert values == [{'id': 1, 'name': 'x'}, {'id': 3, 'name': 'y'}]
+    assert [i for i, _ in errors] == [1, 2]
+    assert all(isinstance(e, AssertionError) for _, e in errors)
+    assert schema.validate_many(sc, []) == ([], [])
+
+def test_validate_many_mask():
+    assert schema.validate_many([int], [[1], [1, '2'], (), None], mask=True) == [True, False, True, False]
+
+def test_validate_many_workers():
+    sc = {'id': lambda x: isinstance(x, int) and x >= 0}
+    values = [{'id': i} for i in range(50)] + [{'id': -1}] + [{'id': i} for i in range(50)]
+    expected = schema.validate_many(sc, values)
+    result = schema.validate_many(sc, values, workers=2, chunksize=7)
+    assert result.values == expected.values
+    assert [i for i, _ in result.errors] == [i for i, _ in expected.errors] == [50]
+    assert schema.validate_many(sc, values, mask=True, workers=2, chunksize=7) == schema.validate_many(sc, values, mask=True)
+
+def test_validate_stream_workers():
+    values = list(range(20)) + ['a'] + list(range(5))
+    with pytest.raises(AssertionError):
+        list(schema.validate_stream([int], values, workers=2, chunksize=3))
+    seen = []
+    with pytest.raises(AssertionError):
+        for x in schema.validate_stream([int], values, workers=2, chunksize=3):
+            seen.append(x)
+    assert seen == list(range(20))
+    errors = []
+    assert list(schema.validate_stream([int], values, workers=2, chunksize=3, errors=errors)) == list(range(20)) + list(range(5))
+    assert [i for i, _ in errors] == [20]
+
 # common tests between python and clojure
 
 def test_set_schema():
@@ -263,6 +858,37 @@ def test_future_fail():
     with pytest.raises(AssertionError):
         f.set_result(1)
 
+def test_future_fail_is_patched_once():
+    calls = []
+    f = tornado.concurrent.Future()
+    with pytest.raises(schema.ValidationError) as e:
+        validate([[lambda x: calls.append(x) or True]], [[f], 'x'])
+    assert e.value.path == [1]
+    f.set_result(1)
+    assert calls == [1]
+
+def test_union_builds_errors_only_on_failure(monkeypatch):
+    reraised = []
+    reraise = schema._reraise
+    monkeypatch.setattr(schema, '_reraise', lambda *a: reraised.append(a) or reraise(*a))
+    sc = (':or', {'kind': 'a', 'n': int}, {'kind': 'b', 'n': int})
+    assert schema._compile(sc)({'kind': 'b', 'n': 1}) == {'kind': 'b', 'n': 1}
+    assert not reraised
+    with pytest.raises(schema.ValidationError):
+        schema._compile(sc)({'kind': 'c', 'n': 1})
+    assert reraised
+
+def test_union_future_is_patched_once():
+    calls = []
+    f = tornado.concurrent.Future()
+    assert validate((':or', int, {'a': lambda x: calls.append(x) or True}), {'a': f})['a'] is f
+    f.set_result(1)
+    assert calls == [1]
+    f = tornado.concurrent.Future()
+    assert not schema.errors((':or', int, {'a': [lambda x: calls.append(x) or True]}), {'a': [f]})
+    f.set_result(2)
+    assert calls == [1, 2]
+
 def test_union():
     schema = (':or', str, None)
     assert validate(schema, 'foo') == 'foo'
@@ -270,6 +896,112 @@ def test_union():
     with pytest.raises(AssertionError):
         validate(schema, True)
 
+def test_error_schema_source_is_read_once(monkeypatch):
+    sc = {'a': lambda x: x > 0}
+    with pytest.raises(AssertionError) as first:
+        validate(sc, {'a': 0})
+    assert "sc = {'a': lambda x: x > 0}" in str(first.value)
+    def fail(*a, **kw):
+        raise Exception('should be cached')
+    monkeypatch.setattr('builtins.open', fail)
+    with pytest.raises(AssertionError) as second:
+        validate(sc, {'a': 0})
+    assert str(first.value) == str(second.value)
+
+def test_validation_error():
+    with pytest.raises(schema.ValidationError) as e:
+        validate({'a': {'b': int}}, {'a': {}})
+    assert e.value.path == ['a', 'b'] and e.value.reason == 'missing-key'
+    with pytest.raises(schema.ValidationError) as e:
+        validate({'a': int}, {'a': 1, 'b': 2}, exact_match=True)
+    assert e.value.path == ['b'] and e.value.reason == 'unknown-key'
+    with pytest.raises(schema.ValidationError) as e:
+        validate({str: [(int, str)]}, {'k': [[1, 'a'], [1, 2]]}, copy=False)
+    assert e.value.path == ['k', 1, 1] and e.value.reason == 'type'
+    assert e.value.schema is str and e.value.value == 2
+    with pytest.raises(schema.ValidationError) as e:
+        validate({'a': (':or', int, str)}, {'a': 1.0})
+    assert e.value.path == ['a'] and e.value.reason == 'union'
+    with pytest.raises(AssertionError) as e:
+        validate(lambda x: x > 0, 0)
+    assert e.value.reason == 'predicate'
+
+def test_validation_error_is_truncated():
+    value = {'items': list(range(100000)) + ['x']}
+    with pytest.raises(schema.ValidationError) as e:
+        validate({'items': [int]}, value)
+    assert e.value.path == ['items', 100000]
+    assert len(str(e.value)) < 3 * schema.ValidationError.dump_size
+
+def test_errors():
+    sc = {'user': {'name': str, 'roles': [(':or', 'admin', 'user')]}, 'ids': [int], 'extra': (':optional', bool, False)}
+    value = {'user': {'roles': ['admin', 'root', 'x']}, 'ids': [1, '2', 3, None]}
+    errors = schema.errors(sc, value)
+    assert [(e.path, e.reason) for e in errors] == [
+        (['user', 'roles', 1], 'union'),
+        (['user', 'roles', 2], 'union'),
+        (['user', 'name'], 'missing-key'),
+        (['ids', 1], 'type'),
+        (['ids', 3], 'type'),
+    ]
+    assert schema.errors(sc, {'user': {'name': 'jane', 'roles': []}, 'ids': []}) == []
+    with pytest.raises(schema.ValidationError) as e:
+        validate(sc, value, collect=True)
+    assert e.value.reason == 'errors' and len(e.value.errors) == 5
+    assert 'path: [\'ids\', 3]' in str(e.value)
+    assert validate(sc, {'user': {'name': 'jane', 'roles': []}, 'ids': []}, collect=True)['extra'] is False
+
+def test_errors_on_long_lists():
+    errors = schema.errors([{'id': int}], [{'id': 'x'}] * 10000)
+    assert len(errors) == 10000 and errors[-1].path == [9999, 'id']
+
+def test_generate():
+    sc = {'id': int,
+          'tags': [str],
+          'kind': (':or', 'a', 'b'),
+          'scores': {str: (float, int)},
+          'ok': (':or', bool, lambda x: x == 'yes'),
+          'opt': (':optional', {int}, set())}
+    fn = schema.generate(sc, exact_match=True)
+    assert 'def validate(value):' in fn.source
+    for value in [{'id': 1, 'tags': ['x'], 'kind': b'a', 'scores': {'x': [1.0, 2]}, 'ok': 'yes'},
+                  {'id': 1, 'tags': (), 'kind': 'b', 'scores': {}, 'ok': True, 'opt': {1}}]:
+        assert fn(value) == validate(sc, value, exact_match=True)
+    for value in [{'id': '1', 'tags': [], 'kind': 'a', 'scores': {}, 'ok': True},
+                  {'id': 1, 'tags': [], 'kind': 'a', 'scores': {'x': [1.0]}, 'ok': True},
+                  {'id': 1, 'tags': [], 'kind': 'a', 'scores': {}, 'ok': True, 'extra': 1},
+                  {'tags': [], 'kind': 'a', 'scores': {}, 'ok': True}]:
+        with pytest.raises(schema.ValidationError) as e:
+            fn(value)
+        with pytest.raises(schema.ValidationError) as expected:
+            validate(sc, value, exact_match=True)
+        assert (e.value.path, e.value.reason, str(e.value)) == (expected.value.path, expected.value.reason, str(expected.value))
+
+def test_precompile(tmp_path, monkeypatch):
+    (tmp_path / 'precompiled_schemas.py').write_text("user = {'name': str, 'tags': [str]}\nNAME = 'user'\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(schema, '_codes', {})
+    path = schema.precompile('precompiled_schemas')
+    assert os.path.exists(path)
+    import precompiled_schemas
+    assert validate(precompiled_schemas.user, {'name': 'jane', 'tags': []}) == {'name': 'jane', 'tags': []}
+    schema._codes.clear()
+    schema.precompile('precompiled_schemas', write=False)
+    assert len(schema._codes) == 1 # loaded from path
+    (tmp_path / 'precompiled_schemas.py').write_text("user = {'name': str}\n")
+    schema._codes.clear()
+    schema.precompile('precompiled_schemas', write=False)
+    assert schema._codes == {} # stale
+
+def test_union_error_includes_every_alternative():
+    sc = {'a': (':or', float, None)}
+    with pytest.raises(AssertionError) as e:
+        validate(sc, {'a': 'x'})
+    assert 'did not match *any* of' in str(e.value)
+    assert 'is not a: float' in str(e.value)
+    assert 'does not equal: None' in str(e.value)
+    assert "'a': 'x'" in str(e.value)
+
 def test_union_empty():
     schema = (':or',)
     with pytest.raises(AssertionError):
@@ -305,6 +1037,111 @@ def test_intersection_applied_in_order():
     with pytest.raises(AssertionError):
         validate(schema, {'name': 'not-an-int'})
 
+def test_range():
+    sc = (':range', 0, None)
+    assert validate(sc, 0) == 0
+    assert validate(sc, 10 ** 9) == 10 ** 9
+    for value in [-1, 'a', None, float('nan')]:
+        with pytest.raises(schema.ValidationError):
+            validate((':range', 0, 1), value)
+    assert [e.reason for e in schema.errors({'a': (':range', 0, 1)}, {'a': 2})] == ['range']
+    with pytest.raises(AssertionError):
+        validate((':range', 0), 0)
+
+def test_arrays():
+    values = array.array('i', [1, 2, 3])
+    assert validate([int], values) is values
+    assert validate([(':range', 1, 3)], values) is values
+    assert validate([int], memoryview(values)) is not None
+    with pytest.raises(schema.ValidationError) as e:
+        validate([(':range', 1, 2)], values)
+    assert e.value.path == [2]
+    with pytest.raises(AssertionError):
+        validate([float], values)
+    with pytest.raises(AssertionError):
+        validate([str], values)
+    assert schema.is_valid([float], array.array('d', [1.0, float('nan')]))
+    assert not schema.is_valid([(':range', 0, 2)], array.array('d', [1.0, float('nan')]))
+
+def test_numpy_arrays():
+    numpy = pytest.importorskip('numpy')
+    values = numpy.linspace(0, 1, 1000)
+    sc = [(':and', float, (':range', 0, 1))]
+    assert validate(sc, values) is values
+    assert validate([int], numpy.arange(10, dtype=numpy.uint8)) is not None
+    values[500] = numpy.nan
+    assert [(e.path, e.reason) for e in schema.errors(sc, values)] == [([500], 'range')]
+    with pytest.raises(AssertionError):
+        validate([int], values)
+    with pytest.raises(AssertionError):
+        validate([float], numpy.zeros((2, 2)))
+
+def test_scalar_lists():
+    class Id(int):
+        pass
+    values = [1, True, Id(3)]
+    assert validate([int], values) == values
+    assert validate([int], values, copy=False) is values
+    assert validate([(':or', int, None)], (1, None)) == [1, None]
+    assert validate([(':or', 'red', 'blue')], ['red', b'blue']) == ['red', 'blue']
+    assert not schema.is_valid([(':or', 'red', 'blue')], ['red', ['blue']])
+    with pytest.raises(schema.ValidationError) as e:
+        validate([(':or', int, float)], [1, 2.0, 'x', None])
+    assert e.value.path == [2]
+    with pytest.raises(schema.ValidationError) as e:
+        validate([str], ['a', 'b', 1])
+    assert e.value.path == [2]
+    future = tornado.concurrent.Future()
+    validate([int], [1, future])
+    with pytest.raises(AssertionError):
+        future.set_result('x')
+
+def test_list_of_records():
+    sc = [{'id': int, 'status': (':or', 'new', 'paid'), 'tags': [(':or', 'a', 'b')], 'note': (':optional', str, '')}]
+    rows = [{'id': i, 'status': 'new', 'tags': ['a', b'b'], 'extra': 1} for i in range(20)]
+    assert validate(sc, rows) == [{'id': i, 'status': 'new', 'tags': ['a', 'b'], 'note': ''} for i in range(20)]
+    rows = [{'note': 'x', 'id': i, 'status': 'paid', 'tags': []} for i in range(20)]
+    assert validate(sc, rows, copy=False) is rows
+    assert [list(row) for row in validate(sc, rows)] == [['note', 'id', 'status', 'tags']] * 20
+    rows[7]['status'] = 'lost'
+    with pytest.raises(schema.ValidationError) as e:
+        validate(sc, rows)
+    assert e.value.path == [7, 'status']
+    assert not schema.is_valid(sc, rows)
+    rows[7]['status'] = 'paid'
+    del rows[9]['id']
+    with pytest.raises(schema.ValidationError) as e:
+        validate(sc, rows)
+    assert e.value.path == [9, 'id']
+    assert [e.path for e in schema.errors(sc, rows)] == [[9, 'id']]
+
+def test_list_of_records_failing_with_futures():
+    calls = []
+    sc = [{'ids': [lambda x: calls.append(x) or True], 'id': int}]
+    futures = [tornado.concurrent.Future() for _ in range(20)]
+    rows = [{'id': i, 'ids': [f]} for i, f in enumerate(futures)]
+    rows[15]['id'] = 'x'
+    with pytest.raises(schema.ValidationError) as e:
+        validate(sc, rows)
+    assert e.value.path == [15, 'id']
+    for f in futures:
+        f.set_result(1)
+    assert len(calls) == 15 # the futures of the rows before the failure, each validated once
+
+def test_list_of_records_with_predicates_which_raise():
+    sc = [{'a': lambda x: x > 0, 'b': lambda x: x.startswith('a')}]
+    rows = [{'a': 1, 'b': 'abc'} for _ in range(20)]
+    rows[0]['b'] = 'zzz'
+    rows[5]['a'] = 'str'
+    for copy in [True, False]:
+        with pytest.raises(schema.ValidationError) as e:
+            validate(sc, rows, copy=copy)
+        assert e.value.path == [0, 'b']
+    assert not schema.is_valid(sc, rows)
+    rows[0]['b'] = 'abc'
+    with pytest.raises(TypeError):
+        validate(sc, rows)
+
 def test_predicate():
     schema = {str: callable}
     val = {'fn': lambda: None}